@@ -1,2 +1,15 @@
-
-from reader_client import GoogleReaderClient, GoogleLoginFailed, GoogleOperationFailed
+from reader_client import GoogleReaderClient, GoogleLoginFailed, GoogleOperationFailed, \
+    GoogleDeadlineExceeded, GoogleServiceUnavailable
+from transport import Transport, UrlfetchTransport, PooledTransport, Response
+from cache import ValidatorCache
+from stats import ClientStats
+from retry import RetryPolicy, CircuitBreaker, CircuitBreakers, Deadline
+from throttle import RateLimiter, TokenBucket, MemcacheRateLimit, AdaptiveConcurrencyLimiter
+from editbuffer import SubscriptionEditBuffer
+from sessions import SessionStore, MemorySessionStore, MemcacheSessionStore, NdbSessionStore
+from pool import ReaderClientPool
+from atom import AtomStream, AtomPage, Entry, extract_entries
+from jsonstream import JsonItemStream
+from columns import ItemColumns
+from itemids import parse_id, parse_ids, short_ids, long_ids, normalize_ids
+from pager import Pager
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""
+Alternative representations of Google Reader Atom pages, lighter than
+the objectify tree returned by default (see GoogleReaderClient.get_feed_atom).
+"""
+
+import threading
+from io import BytesIO
+
+from lxml import etree, objectify
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+GR_NS = 'http://www.google.com/schemas/reader/atom/'
+
+NAMESPACES = {'atom': ATOM_NS, 'gr': GR_NS}
+
+ENTRY_TAG = '{%s}entry' % ATOM_NS
+LINK_TAG = '{%s}link' % ATOM_NS
+
+# Settings of all parsers: replies are plain data, nothing is fetched
+# or expanded, and whitespace between elements is dropped
+PARSER_OPTIONS = dict(no_network=True, load_dtd=False, resolve_entities=False,
+                      remove_blank_text=True)
+
+_parsers = threading.local()
+
+def get_parser(format, huge_tree=False):
+    """
+    Parser for format 'etree' or 'obj' (objectify), created once per
+    thread and reused. huge_tree lifts libxml2 limits of document depth
+    and text size (needed for some very large pages).
+    """
+    key = (format, huge_tree)
+    cache = getattr(_parsers, 'cache', None)
+    if cache is None:
+        cache = _parsers.cache = {}
+    parser = cache.get(key)
+    if parser is None:
+        if format == 'obj':
+            parser = objectify.makeparser(huge_tree=huge_tree, **PARSER_OPTIONS)
+        else:
+            parser = etree.XMLParser(huge_tree=huge_tree, **PARSER_OPTIONS)
+        cache[key] = parser
+    return parser
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+class AtomStream(object):
+    """
+    Entries of an Atom page parsed incrementally (format='stream').
+    Iterating yields the <entry> elements (lxml.etree) one by one, each
+    of them is freed when the next one is requested, so copy what you
+    need before moving on. The stream can be iterated only once.
+
+    feed holds the feed level metadata: text of the simple elements by
+    their local name (id, title, updated, continuation - the value for
+    continue_from, or None on the last page...) and 'links', list of
+    the attribute dictionaries of the <link> elements. Metadata which
+    precede the entries (all of it, in Google Reader replies) are
+    available before iterating.
+
+    Malformed XML raises lxml.etree.XMLSyntaxError while iterating.
+    """
+
+    def __init__(self, content, huge_tree=False):
+        self._events = etree.iterparse(BytesIO(content),
+                                       events=('start', 'end'),
+                                       huge_tree=huge_tree, **PARSER_OPTIONS)
+        self._depth = 0
+        self._in_entries = False
+        self._done = False
+        self._last = None
+        self._feed = {'continuation': None, 'links': []}
+
+    @property
+    def feed(self):
+        while not self._in_entries and not self._done:
+            self._step()
+        return self._feed
+
+    @property
+    def continuation(self):
+        return self.feed['continuation']
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        self._free_last()
+        while not self._done:
+            entry = self._step()
+            if entry is not None:
+                self._last = entry
+                return entry
+        raise StopIteration
+
+    def _step(self):
+        """
+        Processes one parser event, returns the entry it completed (if any).
+        """
+        try:
+            event, elem = next(self._events)
+        except StopIteration:
+            self._done = True
+            self._free_last()
+            return None
+        if event == 'start':
+            self._depth += 1
+            if self._depth == 2 and elem.tag == ENTRY_TAG:
+                self._in_entries = True
+            return None
+        self._depth -= 1
+        if self._depth != 1:
+            return None
+        if elem.tag == ENTRY_TAG:
+            return elem
+        if elem.tag == LINK_TAG:
+            self._feed['links'].append(dict(elem.attrib))
+        elif len(elem) == 0:
+            self._feed[_local_name(elem.tag)] = elem.text
+        self._free(elem)
+        return None
+
+    def _free_last(self):
+        if self._last is not None:
+            self._free(self._last)
+            self._last = None
+
+    def _free(self, elem):
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            parent.remove(elem)
+
+class Entry(object):
+    """
+    Compact record of one Atom entry (format='records'): id, title,
+    link (alternate URL), links (tuple of (rel, href) pairs), published
+    and updated (ISO timestamps as given by Google) and author (name).
+    Missing values are None.
+    """
+
+    __slots__ = ('id', 'title', 'link', 'links', 'published', 'updated',
+                 'author')
+
+    def __init__(self, id=None, title=None, link=None, links=(),
+                 published=None, updated=None, author=None):
+        self.id = id
+        self.title = title
+        self.link = link
+        self.links = links
+        self.published = published
+        self.updated = updated
+        self.author = author
+
+    def __repr__(self):
+        return '<Entry %s>' % self.id
+
+class AtomPage(object):
+    """
+    Atom page as list of Entry records (format='records'), plus
+    continuation (the value for continue_from, None on the last page)
+    and feed (feed level metadata, as in AtomStream).
+
+    Parsed incrementally, the page tree is never built. Values which
+    repeat among the entries (authors, link relations, timestamps...)
+    are stored once.
+    """
+
+    __slots__ = ('entries', 'continuation', 'feed')
+
+    def __init__(self, entries, feed):
+        self.entries = entries
+        self.feed = feed
+        self.continuation = feed.get('continuation')
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def parse(cls, content, huge_tree=False):
+        strings = {}
+        def shared(value):
+            if value is None:
+                return None
+            return strings.setdefault(value, value)
+
+        stream = AtomStream(content, huge_tree)
+        entries = []
+        for elem in stream:
+            entry = Entry()
+            links = []
+            for child in elem:
+                name = _local_name(child.tag)
+                if name == 'link':
+                    rel = shared(child.get('rel', 'alternate'))
+                    href = child.get('href')
+                    links.append((rel, href))
+                    if rel == 'alternate' and entry.link is None:
+                        entry.link = href
+                elif name == 'author':
+                    entry.author = shared(child.findtext('{%s}name' % ATOM_NS))
+                elif name == 'id':
+                    entry.id = child.text
+                elif name == 'title':
+                    entry.title = child.text
+                elif name in ('published', 'updated'):
+                    setattr(entry, name, shared(child.text))
+            entry.links = tuple(links)
+            entries.append(entry)
+        return cls(entries, stream.feed)
+
+def _xpath(path):
+    return etree.XPath(path, namespaces=NAMESPACES, smart_strings=False)
+
+ENTRIES = _xpath('atom:entry')
+ENTRY_COUNT = _xpath('count(atom:entry)')
+
+def _text(elem):
+    # Text of the element and its descendants (as XPath string())
+    for _ in elem.iterchildren():
+        return ''.join(elem.itertext())
+    return elem.text
+
+def _attribute(name):
+    return lambda elem: elem.get(name)
+
+class _Extractor(object):
+    """
+    Extracts one field of all entries of a page.
+
+    values - path (relative to the entry) of the text or attribute
+        nodes of single valued field
+    select, depth, value - XPath selecting the elements which hold the
+        values of all entries, how many levels below the entry they
+        are, and the value of such element
+    many - the field is a list
+
+    Single valued fields are taken by two C-level passes (the values of
+    the whole page and the count of entries having exactly one), as long
+    as every entry has exactly one value. Otherwise (and for lists) the
+    selected elements are assigned to their entries one by one.
+    """
+
+    def __init__(self, values, select, depth, value, many=False):
+        if values is not None:
+            self.values = _xpath('atom:entry/' + values)
+            single = 'count(%s) = 1' % values
+            if values.endswith('/text()'):
+                # string() of mixed content is more than the one text node
+                single += ' and not(%s/*)' % values[:-len('/text()')]
+            self.aligned = _xpath('count(atom:entry[%s])' % single)
+        else:
+            self.values = None
+        self.select = _xpath(select)
+        self.depth = depth
+        self.value = value
+        self.many = many
+
+    def __call__(self, tree, count, entries):
+        if self.values is not None and self.aligned(tree) == count:
+            return [value or None for value in self.values(tree)]
+        if entries[0] is None:
+            entries[0] = dict((entry, i) for i, entry
+                              in enumerate(ENTRIES(tree)))
+        positions = entries[0]
+        if self.many:
+            values = [[] for _ in xrange(count)]
+        else:
+            values = [None] * count
+        for elem in self.select(tree):
+            owner = elem
+            for _ in xrange(self.depth):
+                owner = owner.getparent()
+            i = positions[owner]
+            if self.many:
+                values[i].append(self.value(elem))
+            elif values[i] is None:
+                values[i] = self.value(elem) or None
+        return values
+
+EXTRACTORS = {
+    'id': _Extractor('atom:id/text()', 'atom:entry/atom:id', 1, _text),
+    'original_id': _Extractor(
+        'atom:id/@gr:original-id', 'atom:entry/atom:id[@gr:original-id]', 1,
+        _attribute('{%s}original-id' % GR_NS)),
+    'title': _Extractor('atom:title/text()', 'atom:entry/atom:title', 1, _text),
+    'link': _Extractor(
+        "atom:link[@rel='alternate' or not(@rel)][1]/@href",
+        "atom:entry/atom:link[@rel='alternate' or not(@rel)]", 1,
+        _attribute('href')),
+    'links': _Extractor(None, 'atom:entry/atom:link', 1, _attribute('href'),
+                        many=True),
+    'published': _Extractor('atom:published/text()',
+                            'atom:entry/atom:published', 1, _text),
+    'updated': _Extractor('atom:updated/text()', 'atom:entry/atom:updated', 1,
+                          _text),
+    'author': _Extractor('atom:author/atom:name/text()',
+                         'atom:entry/atom:author/atom:name', 2, _text),
+    'crawled': _Extractor(
+        '@gr:crawl-timestamp-msec', 'atom:entry[@gr:crawl-timestamp-msec]', 0,
+        _attribute('{%s}crawl-timestamp-msec' % GR_NS)),
+    'summary': _Extractor('atom:summary/text()', 'atom:entry/atom:summary', 1,
+                          _text),
+    'content': _Extractor('atom:content/text()', 'atom:entry/atom:content', 1,
+                          _text),
+    'categories': _Extractor(None, 'atom:entry/atom:category', 1,
+                             _attribute('term'), many=True),
+    'source': _Extractor(
+        'atom:source/@gr:stream-id', 'atom:entry/atom:source[@gr:stream-id]', 1,
+        _attribute('{%s}stream-id' % GR_NS)),
+    }
+
+DEFAULT_FIELDS = ('id', 'title', 'link', 'published', 'updated', 'author')
+
+def extract_entries(tree, fields=DEFAULT_FIELDS):
+    """
+    Extracts given fields (see EXTRACTORS for the names) of all entries
+    of a parsed Atom page (format 'etree' or 'obj', or any lxml tree of
+    the page), each field by precompiled XPath expressions evaluated
+    over the whole page (see _Extractor).
+
+    Returns dictionary field -> list of values (one per entry, in page
+    order). Missing single values are None, list fields (links,
+    categories) give lists.
+    """
+    try:
+        extractors = [(field, EXTRACTORS[field]) for field in fields]
+    except KeyError, e:
+        raise ValueError("Unknown entry field %s" % e)
+    if hasattr(tree, 'getroot'):
+        tree = tree.getroot()
+    count = int(ENTRY_COUNT(tree))
+    # entry -> position, built only if some field needs it
+    entries = [None]
+    return dict((field, extractor(tree, count, entries))
+                for field, extractor in extractors)
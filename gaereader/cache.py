@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Conditional GET support: remembers ETag/Last-Modified validators of the
+list and Atom replies, together with the reply itself, so that unchanged
+resources are answered by 304 Not Modified and are not downloaded and
+parsed again.
+"""
+
+from collections import OrderedDict
+
+class CachedReply(object):
+    """
+    Validators and content of one reply. parsed holds the parsed reply
+    per format ('obj', 'etree', ...), filled as formats are requested.
+    """
+
+    __slots__ = ('etag', 'last_modified', 'content', 'parsed')
+
+    def __init__(self, etag, last_modified, content):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content = content
+        self.parsed = {}
+
+    def request_headers(self):
+        """
+        Headers making the request conditional.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class ValidatorCache(object):
+    """
+    Bounded (LRU) url -> CachedReply mapping.
+
+    max_entries=0 disables caching.
+    """
+
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, url):
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._entries[url] = entry
+        return entry
+
+    def put(self, url, entry):
+        self._entries.pop(url, None)
+        if self.max_entries <= 0:
+            return
+        self._entries[url] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, url):
+        self._entries.pop(url, None)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar storage of stream items, for sorting and filtering items of
+many feeds without walking their JSON dictionaries.
+"""
+
+import heapq
+from array import array
+
+from itemids import INT64, parse_id
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+class ItemColumns(object):
+    """
+    Items held column by column: ids (as signed 64 bit integers),
+    crawled (crawl time, milliseconds) and published (seconds) are
+    packed integer arrays, streams (origin stream ids) and titles are
+    lists of strings shared among the items (missing ones are None).
+
+    sort, between and top return new ItemColumns, key being the name of
+    an integer column.
+
+        columns = ItemColumns.from_items(reply['items'])
+        newest = columns.between(start=yesterday).top(50)
+    """
+
+    INTEGER_COLUMNS = ('ids', 'crawled', 'published')
+
+    def __init__(self):
+        self.ids = array(INT64)
+        self.crawled = array(INT64)
+        self.published = array(INT64)
+        self.streams = []
+        self.titles = []
+        self._strings = {}
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Builds the columns from item dictionaries (the 'items' of
+        feed_contents reply, or JsonItemStream).
+        """
+        columns = cls()
+        columns.extend(items)
+        return columns
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _shared(self, value):
+        if value is None:
+            return None
+        return self._strings.setdefault(value, value)
+
+    def append(self, item):
+        """
+        Adds the item, or raises ValueError (adding nothing) if it is
+        malformed.
+        """
+        # All values are taken before any column grows, so that a bad
+        # item can not leave the columns of different lengths
+        try:
+            item_id = parse_id(item['id'])
+            stream = self._shared((item.get('origin') or {}).get('streamId'))
+            title = self._shared(item.get('title'))
+        except (KeyError, TypeError, AttributeError), e:
+            raise ValueError("Malformed item %r: %r" % (item, e))
+        crawled = _int(item.get('crawlTimeMsec'))
+        published = _int(item.get('published'))
+        self.ids.append(item_id)
+        self.crawled.append(crawled)
+        self.published.append(published)
+        self.streams.append(stream)
+        self.titles.append(title)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def rows(self):
+        """
+        Iterates (id, crawled, published, stream, title) tuples.
+        """
+        return iter(zip(self.ids, self.crawled, self.published,
+                        self.streams, self.titles))
+
+    def take(self, indexes):
+        """
+        New ItemColumns holding the items at given positions, in their order.
+        """
+        result = ItemColumns()
+        result._strings = self._strings
+        for name in self.INTEGER_COLUMNS:
+            column = getattr(self, name)
+            getattr(result, name).extend(column[i] for i in indexes)
+        result.streams = [self.streams[i] for i in indexes]
+        result.titles = [self.titles[i] for i in indexes]
+        return result
+
+    def _key(self, key):
+        if key not in self.INTEGER_COLUMNS:
+            raise ValueError("Can not order by %s" % key)
+        return getattr(self, key)
+
+    def sort(self, key='published', reverse=True):
+        """
+        Items ordered by key column (newest first by default).
+        """
+        column = self._key(key)
+        return self.take(sorted(xrange(len(column)), key=column.__getitem__,
+                                reverse=reverse))
+
+    def between(self, start=None, end=None, key='published'):
+        """
+        Items with start <= key < end (None meaning unbounded), in the
+        current order.
+        """
+        column = self._key(key)
+        return self.take([i for i, value in enumerate(column)
+                          if (start is None or value >= start)
+                          and (end is None or value < end)])
+
+    def top(self, n, key='published'):
+        """
+        n items with the greatest key (the newest ones by default),
+        greatest first.
+        """
+        column = self._key(key)
+        return self.take(heapq.nlargest(n, xrange(len(column)),
+                                        key=column.__getitem__))
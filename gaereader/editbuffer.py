@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write-behind buffer of subscription edits, merging pending changes of
+every feed into a single subscription/edit request.
+"""
+
+from collections import OrderedDict, namedtuple
+
+from google.appengine.ext import ndb
+
+import logging
+log = logging.getLogger("reader")
+
+# Result of one feed of subscribe_many/unsubscribe_many or of a buffer
+# flush, error is None on success
+FeedEditResult = namedtuple('FeedEditResult', 'feed_url error')
+
+def _tag_key(tag):
+    """
+    Tag name regardless of the form it is given in
+    ("tag", "user/-/label/tag" or "user/123/label/tag").
+    """
+    if tag.startswith('user/') and '/label/' in tag:
+        return tag.split('/label/', 1)[1]
+    return tag
+
+def _feed_key(feed_url):
+    if not feed_url.startswith("feed/"):
+        feed_url = "feed/" + feed_url
+    return feed_url
+
+class PendingEdit(object):
+    """
+    Merged changes of one feed: operation ('subscribe', 'unsubscribe'
+    or 'edit'), title and tags (tag key -> (tag, True if added)).
+    """
+
+    __slots__ = ('operation', 'title', 'tags')
+
+    def __init__(self):
+        self.operation = 'edit'
+        self.title = None
+        self.tags = OrderedDict()
+
+    def add_tags(self):
+        return [tag for tag, add in self.tags.values() if add]
+
+    def remove_tags(self):
+        return [tag for tag, add in self.tags.values() if not add]
+
+class SubscriptionEditBuffer(object):
+    """
+    Collects subscription changes and sends them later, one request per
+    feed. Created by GoogleReaderClient.edit_buffer.
+
+    Changes of the same feed are merged, and the last change wins when
+    they conflict: adding a tag and then removing it sends only the
+    removal, unsubscribing drops all edits queued for the feed before.
+
+    Pending changes are sent when max_pending feeds are waiting (the
+    method queueing the change returns the flush future then), when
+    the oldest change waits max_delay seconds (if the ndb event loop
+    runs), or on explicit flush().
+
+    Every flush results in list of FeedEditResult (feed_url, error).
+    Failed edits are logged, which is the only trace of failures of
+    the flushes nobody waits for (those done by the timer).
+    """
+
+    def __init__(self, client, max_pending=50, max_delay=5.0):
+        self.client = client
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self._pending = OrderedDict()
+        self._generation = 0
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _edit(self, feed_url):
+        feed_url = _feed_key(feed_url)
+        edit = self._pending.get(feed_url)
+        if edit is None:
+            edit = self._pending[feed_url] = PendingEdit()
+        return edit
+
+    def _queued(self):
+        if len(self._pending) >= self.max_pending:
+            return self.flush()
+        if self._timer is None and self.max_delay is not None:
+            self._timer = self._flush_later(self._generation)
+        return None
+
+    @ndb.tasklet
+    def _flush_later(self, generation):
+        yield ndb.sleep(self.max_delay)
+        if generation == self._generation:
+            yield self.flush()
+
+    def subscribe_feed(self, feed_url, title = None):
+        edit = self._edit(feed_url)
+        edit.operation = 'subscribe'
+        if title:
+            edit.title = title
+        return self._queued()
+
+    def unsubscribe_feed(self, feed_url):
+        edit = self._edit(feed_url)
+        edit.operation = 'unsubscribe'
+        edit.title = None
+        edit.tags.clear()
+        return self._queued()
+
+    def change_feed_title(self, feed_url, title):
+        edit = self._edit(feed_url)
+        if edit.operation == 'unsubscribe':
+            edit.operation = 'edit'
+        edit.title = title
+        return self._queued()
+
+    def add_feed_tag(self, feed_url, title, tag):
+        edit = self._edit(feed_url)
+        if edit.operation == 'unsubscribe':
+            edit.operation = 'edit'
+        if title:
+            edit.title = title
+        key = _tag_key(tag)
+        edit.tags.pop(key, None)
+        edit.tags[key] = (tag, True)
+        return self._queued()
+
+    def remove_feed_tag(self, feed_url, title, tag):
+        edit = self._edit(feed_url)
+        if edit.operation == 'unsubscribe':
+            edit.operation = 'edit'
+        if title:
+            edit.title = title
+        key = _tag_key(tag)
+        edit.tags.pop(key, None)
+        edit.tags[key] = (tag, False)
+        return self._queued()
+
+    @ndb.tasklet
+    def flush(self, deadline = None):
+        """
+        Sends all pending changes, concurrently. Returns list of
+        FeedEditResult, error being the exception for the feeds whose
+        edit failed (those edits are not retried).
+        """
+        pending, self._pending = self._pending, OrderedDict()
+        self._generation += 1
+        self._timer = None
+        edits = [(feed_url, edit) for feed_url, edit in pending.items()
+                 if edit.operation != 'edit' or edit.title or edit.tags]
+        if not edits:
+            raise ndb.Return([])
+        log.info("Flushing %d subscription edits" % len(edits))
+        futures = [self.client._edit_subscription(
+                       feed_url, edit.operation, title = edit.title,
+                       add_tags = edit.add_tags(),
+                       remove_tags = edit.remove_tags(),
+                       deadline = deadline)
+                   for feed_url, edit in edits]
+        results = []
+        for (feed_url, edit), future in zip(edits, futures):
+            try:
+                yield future
+                error = None
+            except Exception, e:
+                error = e
+                log.error("Subscription edit (%s) of %s failed: %s" % (
+                        edit.operation, feed_url, error))
+            results.append(FeedEditResult(feed_url, error))
+        raise ndb.Return(results)
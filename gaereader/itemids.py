@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Conversion between the two forms of Google Reader item ids: short
+signed decimal ('-8654279325215116158') and long
+('tag:google.com,2005:reader/item/87e5d2ce598bb482'). Both denote the
+same 64 bit number, which is what the functions below work with
+(signed, so that it fits packed arrays).
+"""
+
+from array import array
+
+LONG_ID_PREFIX = 'tag:google.com,2005:reader/item/'
+
+# Signed 64 bit integers (Python 2 array has no 'q' typecode, but 'l'
+# is 64 bit on 64 bit Linux)
+if 'q' in getattr(array, 'typecodes', ''):
+    INT64 = 'q'
+else:
+    INT64 = 'l'
+
+_PREFIX_LENGTH = len(LONG_ID_PREFIX)
+_SIGN = 1 << 63
+_RANGE = 1 << 64
+
+def parse_id(value):
+    """
+    Item id in any form (or already an integer) as signed 64 bit integer.
+    Raises ValueError if it is not a valid id (also when it does not fit
+    64 bits).
+    """
+    if isinstance(value, (int, long)):
+        number = value
+    elif value.startswith(LONG_ID_PREFIX):
+        number = int(value[_PREFIX_LENGTH:], 16)
+        if not 0 <= number < _RANGE:
+            raise ValueError("Item id %r out of range" % value)
+        if number >= _SIGN:
+            number -= _RANGE
+    else:
+        number = int(value)
+    if not -_SIGN <= number < _SIGN:
+        raise ValueError("Item id %r out of range" % value)
+    return number
+
+def parse_ids(values, unique=False):
+    """
+    Array (INT64) of ids given in any (possibly mixed) forms. With
+    unique=True, repeated ids are dropped (first occurrence is kept).
+    """
+    ids = array(INT64, map(parse_id, values))
+    if unique:
+        seen = set()
+        add = seen.add
+        ids = array(INT64, [i for i in ids if not (i in seen or add(i))])
+    return ids
+
+def short_ids(values):
+    """
+    List of short (decimal) ids of given ids (integers or any form).
+    """
+    return [str(i) for i in map(parse_id, values)]
+
+def long_ids(values):
+    """
+    List of long (tag:google.com) ids of given ids (integers or any form).
+    """
+    prefix = LONG_ID_PREFIX
+    return ['%s%016x' % (prefix, i % _RANGE) for i in map(parse_id, values)]
+
+def normalize_ids(values, form='long', unique=True):
+    """
+    Converts mixed ids to one form ('long' or 'short'), dropping
+    duplicates unless unique=False.
+    """
+    if form not in ('long', 'short'):
+        raise ValueError("Unknown id form %s" % form)
+    ids = parse_ids(values, unique)
+    if form == 'long':
+        return long_ids(ids)
+    return short_ids(ids)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental decoding of Google Reader JSON stream replies (stream
+contents, item contents), see GoogleReaderClient.contents.
+"""
+
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class JsonItemStream(object):
+    """
+    Items of a JSON stream reply decoded one by one (iter_items=True).
+    Iterating yields the dictionaries of the 'items' array, the array
+    itself is never built. The stream can be iterated only once.
+
+    fields - if given, every item is reduced to these keys (those of
+        them which the item has).
+
+    meta holds the other top level values (id, title, updated,
+    continuation...). Values which precede the items (all of them, in
+    Google Reader replies) are available before iterating.
+
+    Malformed JSON raises ValueError while iterating.
+    """
+
+    def __init__(self, content, fields=None):
+        self._text = content
+        self._decoder = json.JSONDecoder()
+        self._fields = fields and tuple(fields)
+        self._in_items = False
+        self._first_key = True
+        self._first_item = True
+        self._done = False
+        self._meta = {}
+        self._pos = self._expect('{', 0)
+
+    @property
+    def meta(self):
+        while not self._in_items and not self._done:
+            self._next_key()
+        return self._meta
+
+    @property
+    def continuation(self):
+        return self.meta.get('continuation')
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while not self._done:
+            if self._in_items:
+                item = self._next_item()
+                if item is not None:
+                    return item
+            else:
+                self._next_key()
+        raise StopIteration
+
+    def _skip(self, pos):
+        return WHITESPACE.match(self._text, pos).end()
+
+    def _expect(self, char, pos):
+        pos = self._skip(pos)
+        if self._text[pos:pos + 1] != char:
+            raise ValueError("Expected %r at position %d" % (char, pos))
+        return pos + 1
+
+    def _next_key(self):
+        """
+        Decodes next top level value into meta, or enters the items.
+        """
+        pos = self._skip(self._pos)
+        if self._text[pos:pos + 1] == '}':
+            self._done = True
+            return
+        if not self._first_key:
+            pos = self._expect(',', pos)
+        self._first_key = False
+        key, pos = self._decoder.raw_decode(self._text, self._skip(pos))
+        pos = self._expect(':', pos)
+        pos = self._skip(pos)
+        if key == 'items' and self._text[pos:pos + 1] == '[':
+            self._in_items = True
+            self._pos = pos + 1
+            return
+        self._meta[key], self._pos = self._decoder.raw_decode(self._text, pos)
+
+    def _next_item(self):
+        """
+        Decodes next item, returns None (leaving the items) at the end.
+        """
+        pos = self._skip(self._pos)
+        if self._text[pos:pos + 1] == ']':
+            self._in_items = False
+            self._pos = pos + 1
+            return None
+        if not self._first_item:
+            pos = self._skip(self._expect(',', pos))
+        self._first_item = False
+        item, self._pos = self._decoder.raw_decode(self._text, pos)
+        if self._fields is not None:
+            item = dict((name, item[name]) for name in self._fields
+                        if name in item)
+        return item
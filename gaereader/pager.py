@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Following Google Reader continuations page by page, with the next page
+fetched while the current one is being processed.
+"""
+
+from google.appengine.ext import ndb
+from google.appengine.ext.ndb import eventloop
+
+def _run_ready():
+    """
+    Runs the event loop callbacks which are ready, without waiting for
+    RPCs or timers, so that started tasklets get to send their RPCs.
+    """
+    ev = eventloop.get_event_loop()
+    while ev.current or (ev.queue and ev.queue[0][0] <= ev.clock.now()):
+        ev.run0()
+
+class Pager(object):
+    """
+    Walks a paged stream. fetch_page(continuation, count) must return
+    future of (items, continuation) pair, continuation being None on
+    the last page.
+
+    The first page is requested at once and every next one as soon as
+    the previous page arrives, so its fetch overlaps with processing of
+    the current page. Tasklet callers send it on their next yield,
+    iterating sends it before the items are given out.
+
+    Use next_page() in tasklets:
+
+        while True:
+            items = yield pager.next_page()
+            if items is None:
+                break
+            ...
+
+    or iterate the pager to get the items one by one (blocking).
+    continuation keeps the value for resuming after the last delivered
+    page (None when the stream was exhausted).
+    """
+
+    def __init__(self, fetch_page, page_size=100, max_items=None):
+        self._fetch_page = fetch_page
+        self.page_size = page_size
+        self.max_items = max_items
+        self.delivered = 0
+        self.pages = 0
+        self.continuation = None
+        self._next = None
+        if max_items is None or max_items > 0:
+            self._next = self._fetch(None)
+
+    def _fetch(self, continuation):
+        count = self.page_size
+        if self.max_items is not None:
+            count = min(count, self.max_items - self.delivered)
+        return self._fetch_page(continuation, count)
+
+    @ndb.tasklet
+    def next_page(self):
+        """
+        Returns list of items of the next page, None after the last one.
+        """
+        if self._next is None:
+            raise ndb.Return(None)
+        future, self._next = self._next, None
+        items, continuation = yield future
+        items = list(items)
+        if self.max_items is not None:
+            items = items[:self.max_items - self.delivered]
+        self.pages += 1
+        self.delivered += len(items)
+        self.continuation = continuation
+        if not items:
+            raise ndb.Return(None)
+        if continuation and (self.max_items is None
+                             or self.delivered < self.max_items):
+            self._next = self._fetch(continuation)
+        raise ndb.Return(items)
+
+    def __iter__(self):
+        while True:
+            items = self.next_page().get_result()
+            if items is None:
+                return
+            # Nothing runs the event loop while the caller processes
+            # the items, so the next fetch has to be sent now
+            _run_ready()
+            for item in items:
+                yield item
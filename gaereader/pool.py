@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pool of GoogleReaderClient instances serving many Reader accounts
+from one application instance.
+"""
+
+from collections import OrderedDict
+import threading
+
+from reader_client import GoogleReaderClient
+from transport import UrlfetchTransport
+from retry import CircuitBreakers
+from throttle import RateLimiter, AdaptiveConcurrencyLimiter
+
+import logging
+log = logging.getLogger("reader")
+
+class ReaderClientPool(object):
+    """
+    Hands out clients by login, keeping at most max_clients of them
+    (least recently used ones are dropped).
+
+    All clients share one transport, rate limiter, concurrency limiter
+    and set of circuit breakers, while every account keeps its own
+    session, token and caches. The rate and concurrency limiters serve
+    waiting accounts in turn, so one heavy account cannot starve the
+    others.
+
+    The pool, its clients, the transport and the limiters may be shared
+    by threads (of a threadsafe application).
+
+    Clients are created lazy, login happens on their first call. Give
+    session_store (see gaereader.sessions) to keep the sessions of
+    dropped clients, otherwise such account logs in again when it comes
+    back. Other keyword arguments are passed to GoogleReaderClient.
+
+        pool = ReaderClientPool(max_clients=500,
+                                session_store=MemcacheSessionStore())
+        client = pool.get(login, password)
+    """
+
+    def __init__(self, max_clients=100, transport=None, rate_limiter=None,
+                 concurrency=None, circuit_breakers=None, session_store=None,
+                 **client_options):
+        self.max_clients = max_clients
+        self.transport = transport or UrlfetchTransport()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.concurrency = concurrency or AdaptiveConcurrencyLimiter()
+        self.circuit_breakers = circuit_breakers or CircuitBreakers()
+        self.session_store = session_store
+        self.client_options = client_options
+        self.evictions = 0
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, login):
+        return login in self._clients
+
+    def get(self, login, password):
+        """
+        Returns the client of the account, creating it if needed (also
+        when the password changed).
+        """
+        with self._lock:
+            client = self._clients.pop(login, None)
+            if client is None or client._password != password:
+                client = GoogleReaderClient(
+                    login, password, transport=self.transport,
+                    rate_limiter=self.rate_limiter,
+                    concurrency=self.concurrency,
+                    circuit_breakers=self.circuit_breakers,
+                    session_store=self.session_store, lazy=True,
+                    **self.client_options)
+            self._clients[login] = client
+            while len(self._clients) > self.max_clients:
+                evicted, _ = self._clients.popitem(last=False)
+                self.evictions += 1
+                log.debug("Dropping client of %s" % evicted)
+        return client
+
+    def discard(self, login):
+        """
+        Drops the client of the account (for example when its password
+        was revoked).
+        """
+        with self._lock:
+            self._clients.pop(login, None)
+
+    def close(self):
+        """
+        Drops all clients and closes the shared transport.
+        """
+        with self._lock:
+            self._clients.clear()
+        self.transport.close()
@@ -18,11 +18,25 @@ import urllib
 import urllib2
 import re
 import json
+import threading
 import time
+from collections import namedtuple
 from datetime import datetime
 from lxml import etree, objectify
-from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
+from google.appengine.ext.ndb import eventloop
+
+from transport import UrlfetchTransport, GET, POST, ACCEPT_ENCODING, \
+    TRANSIENT_ERRORS, TRANSIENT_STATUS, TIMEOUT_ERRORS, OVERLOAD_STATUS
+from retry import RetryPolicy, CircuitBreakers, Deadline, NO_RETRY
+from throttle import RateLimiter, AdaptiveConcurrencyLimiter
+from editbuffer import SubscriptionEditBuffer, FeedEditResult
+from cache import ValidatorCache, CachedReply
+from stats import ClientStats
+from atom import AtomStream, AtomPage, get_parser, ATOM_NS, GR_NS
+from jsonstream import JsonItemStream
+from columns import ItemColumns
+from pager import Pager
 
 import logging
 log = logging.getLogger("reader")
@@ -30,6 +44,11 @@ log = logging.getLogger("reader")
 TRIM_LOG_MESSAGES_AT = 100
 
 TOKEN_VALID_TIME = 60
+# Token is refreshed in background when less than this many seconds
+# of its validity remain
+TOKEN_REFRESH_MARGIN = 10
+# How often a caller sharing a call in flight checks its own deadline
+DEADLINE_POLL_INTERVAL = 0.05
 #DUMP_REQUESTS = True
 #DUMP_REQUESTS = False
 #DUMP_REPLIES = False
@@ -45,6 +64,18 @@ class GoogleOperationFailed(Exception):
     Exception raised when Google rejects some operation.
     """
     pass
+class GoogleDeadlineExceeded(GoogleOperationFailed):
+    """
+    Exception raised when the operation can not be finished within
+    its deadline.
+    """
+    pass
+class GoogleServiceUnavailable(GoogleOperationFailed):
+    """
+    Exception raised without calling Google when the circuit breaker of
+    the endpoint is open (recent calls kept failing).
+    """
+    pass
 
 # User-agent/client-name
 SOURCE = 'mekk.reader_client'
@@ -69,8 +100,100 @@ IN_STATE_URL = READER_URL + '/atom/user/-/state/com.google/%s'
 GET_FEED_URL = READER_URL + '/atom/feed/'
 READING_TAG_URL = READER_URL + '/atom/%s'
 
+# Item states, usable as tags in edit_item_tags
+STATE_READ = 'user/-/state/com.google/read'
+STATE_KEPT_UNREAD = 'user/-/state/com.google/kept-unread'
+STATE_STARRED = 'user/-/state/com.google/starred'
+
+# Limits of a single edit-tag request (number of items, urlencoded size)
+EDIT_TAG_MAX_ITEMS = 250
+EDIT_TAG_MAX_BYTES = 32 * 1024
+
 RE_FEED_ID_PREFIX = re.compile(r"^feed/")
 
+# Outcome of one feed fetched by fetch_feeds (either result or error is None)
+FeedResult = namedtuple('FeedResult', 'feed_url result error')
+
+def endpoint_family(url):
+    """
+    Groups urls into endpoint families ('login', 'token', 'edit', 'stream',
+    'atom', 'list'), which share circuit breakers and rate limits.
+    """
+    if url.startswith(LOGIN_URL):
+        return 'login'
+    if url.startswith(TOKEN_URL):
+        return 'token'
+    if url.startswith((SUBSCRIPTION_EDIT_URL, SUBSCRIPTION_QUICKADD_URL,
+                       TAG_EDIT_URL, TAG_DISABLE_URL)):
+        return 'edit'
+    if url.startswith((READER_URL + '/api/0/stream/', SEARCH_ITEMS_IDS_URL)):
+        return 'stream'
+    if url.startswith(READER_URL + '/atom/'):
+        return 'atom'
+    return 'list'
+
+@ndb.tasklet
+def _bounded_map(func, items, concurrency):
+    """
+    Calls tasklet func for every item, running at most concurrency of
+    them at once. Returns list of (result, exception) pairs in the order
+    of items.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = iter(xrange(len(items)))
+
+    @ndb.tasklet
+    def worker():
+        for index in pending:
+            try:
+                result = yield func(items[index])
+                results[index] = (result, None)
+            except Exception, e:
+                results[index] = (None, e)
+
+    yield [worker() for _ in xrange(min(concurrency, len(items)))]
+    raise ndb.Return(results)
+
+def _pack_item_params(items, common, max_items):
+    """
+    Splits items (ids or (id, stream) pairs) into lists of post parameters,
+    each holding common parameters and at most max_items i=/s= pairs,
+    within EDIT_TAG_MAX_BYTES when urlencoded.
+    """
+    common_size = len(urllib.urlencode([(key, value.encode('utf-8'))
+                                        for key, value in common]))
+    chunk, count, size = [], 0, common_size
+    for item in items:
+        if isinstance(item, basestring):
+            params = [('i', item)]
+        else:
+            params = [('i', item[0]), ('s', item[1])]
+        item_size = len(urllib.urlencode([(key, value.encode('utf-8'))
+                                          for key, value in params])) + 1
+        if chunk and (count >= max_items or size + item_size > EDIT_TAG_MAX_BYTES):
+            yield chunk + common
+            chunk, count, size = [], 0, common_size
+        chunk.extend(params)
+        count += 1
+        size += item_size
+    if chunk:
+        yield chunk + common
+
+class _Flights(threading.local):
+    """
+    Futures of the operations in flight which concurrent callers share
+    (login, session start, token fetch, identical GETs). ndb futures
+    belong to the event loop of the thread which created them, so every
+    thread shares only its own.
+    """
+
+    def __init__(self):
+        self.token = None
+        self.login = None
+        self.session = None
+        self.calls = dict()
+
 class GoogleReaderClient(object):
 
     """
@@ -86,21 +209,131 @@ class GoogleReaderClient(object):
     - older_first=True - start from older items, not from newest
 
     Remaining functions allow one to manage subscription feeds.
+
+    All HTTP traffic goes through transport (see gaereader.transport),
+    App Engine urlfetch by default. Use PooledTransport to run the client
+    outside App Engine with keep-alive connections.
+
+    Lists and Atom feeds are fetched with conditional GET, validators and
+    replies are kept in validator_cache (see gaereader.cache), except for
+    Atom continuation pages (continue_from), which are not cached. When Google
+    answers 304 Not Modified, the previously parsed object is returned
+    again, so treat the returned objects as read-only.
+
+    Replies are requested compressed (gzip/deflate). Transfer statistics
+    (calls, compressed and uncompressed byte counts) are available via
+    get_stats.
+
+    Atom pages are parsed by per thread parsers which never touch the
+    network, load DTDs or keep blank text (see gaereader.atom). Pass
+    huge_tree=True to lift libxml2 size limits for very large pages.
+
+    Failing GET calls (transport errors, 429 and 5xx replies) are retried
+    according to retry_policy (see gaereader.retry), POSTs only when they
+    are safe to repeat. Each endpoint family has a circuit breaker, while
+    it is open calls fail immediately with GoogleServiceUnavailable. The
+    breakers count failed calls (after their retries), not attempts.
+
+    Public methods accept optional deadline: number of seconds (or
+    gaereader.Deadline) the whole operation may take. It is split among
+    the sub-calls the operation makes and passed to urlfetch as its
+    deadline. If the time runs out, GoogleDeadlineExceeded is raised
+    instead of starting further calls.
+
+    Calls are throttled by rate_limiter (see gaereader.throttle), which
+    may limit every endpoint family separately, locally and globally
+    (per login, through memcache). The number of calls in flight is
+    capped by concurrency, an AdaptiveConcurrencyLimiter which lowers
+    the cap when Google times out or answers 503, and raises it slowly
+    while it copes.
+
+    With session_store (see gaereader.sessions) the session id, user id
+    and token are shared by all clients of the same login, so that new
+    clients skip ClientLogin. When Google rejects the session (401/403),
+    it is dropped from the store, the client logs in again and the call
+    is replayed once.
+
+    The constructor logs in (or restores the stored session) before it
+    returns, blocking the thread. With lazy=True it does not, login
+    happens on the first call made. Use create_async to create clients
+    from tasklets, so that logins overlap with other work:
+
+        client = yield GoogleReaderClient.create_async(login, password)
+
+    A client may be used by many threads at once. They share the
+    session, token and caches, but every thread waits only on the
+    logins and fetches started by itself.
     """
     
-    @ndb.synctasklet
-    def __init__(self, login, password):
-        self.session_id = yield self._get_session_id(login, password)
+    def __init__(self, login, password, transport = None,
+                 validator_cache = None, retry_policy = None,
+                 circuit_breakers = None, rate_limiter = None,
+                 concurrency = None, session_store = None, lazy = False,
+                 huge_tree = False):
+        self.login = login
+        self.huge_tree = huge_tree
+        self._password = password
+        self.session_store = session_store
+        self.transport = transport or UrlfetchTransport()
+        if validator_cache is None:
+            validator_cache = ValidatorCache()
+        self.validator_cache = validator_cache
+        self.stats = ClientStats()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breakers = circuit_breakers or CircuitBreakers()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.concurrency = concurrency or AdaptiveConcurrencyLimiter()
+        self.session_id = None
         self.cached_token = None
         self.cached_token_time = 0
+        self._flights = _Flights()
         self.my_id = '-'
         self.cached_feed_item_ids = dict()
+        if not lazy:
+            self._ensure_session().get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def create_async(cls, login, password, **kwargs):
+        """
+        Creates the client and logs in (or restores the stored session)
+        without blocking. Accepts the same keyword arguments as the
+        constructor. Returns future of the client.
+        """
+        kwargs['lazy'] = True
+        client = cls(login, password, **kwargs)
+        yield client._ensure_session()
+        raise ndb.Return(client)
+
+    def get_stats(self):
+        """
+        Returns dictionary of counters:
+
+        calls - HTTP calls made,
+        bytes_wire - body bytes transferred (compressed),
+        bytes_content - body bytes after decompression,
+        retries - calls repeated after transient failure,
+        circuit_open - calls refused by open circuit breaker,
+        deadline_exceeded - calls refused as their deadline passed,
+        bad_token - calls replayed after Google rejected the token,
+        relogins - logins repeated after Google rejected the session,
+        pages_parsed - Atom pages parsed (formats 'obj', 'etree', 'records'),
+        parse_seconds - total time spent parsing them.
+
+        Key 'circuits' contains the state of circuit breakers, key
+        'concurrency' the state of the concurrency limiter (current cap,
+        calls in flight and waiting, number of cap decreases).
+        """
+        result = self.stats.snapshot()
+        result['circuits'] = self.circuit_breakers.snapshot()
+        result['concurrency'] = self.concurrency.snapshot()
+        return result
 
     ############################################################
     # Small utilities, used mainly internally
 
     @ndb.tasklet
-    def tag_id(self, tag):
+    def tag_id(self, tag, deadline = None):
         """
         Converts tag name (say "Life: Politics" into 
         tag id (say "user/joe/label/Life: Politics").
@@ -108,27 +341,28 @@ class GoogleReaderClient(object):
         If parameter is already in this form, leaves it as-is
         """
         if not tag.startswith('user/'):
-            result = yield self.get_my_id()
+            result = yield self.get_my_id(deadline = deadline)
             tag = 'user/%s/label/%s' % (result, tag)
         raise ndb.Return(tag)
 
     @ndb.tasklet
-    def get_my_id(self):
+    def get_my_id(self, deadline = None):
         """
         Returns true user identifier to be used in API calls, calculating
         it if necessary. Caches the result
         """
         if self.my_id == '-':
-            tl = yield self.get_tag_list()
+            tl = yield self.get_tag_list(deadline = deadline)
             for vl in tl['tags']:
                 m = re.match('user/(\d+)/', vl['id'])
                 if m:
                     self.my_id = m.group(1)
+                    yield self._save_session()
                     break
         raise ndb.Return(self.my_id)
 
     @ndb.tasklet
-    def feed_item_id(self, feed):
+    def feed_item_id(self, feed, deadline = None):
         """
         Returns identifier of the first item of given tag feed.
         Used during sub/unsubscription (for some reason it is needed)
@@ -136,7 +370,8 @@ class GoogleReaderClient(object):
         feed = RE_FEED_ID_PREFIX.sub("", feed)
         i = self.cached_feed_item_ids.get(feed)
         if not i:
-            r = yield self.get_feed_atom(feed, count = 2, format = 'obj')
+            r = yield self.get_feed_atom(feed, count = 2, format = 'obj',
+                                         deadline = deadline)
             i = str(r.entry.id)
             self.cached_feed_item_ids[feed] = i
         raise ndb.Return(i)
@@ -153,8 +388,13 @@ class GoogleReaderClient(object):
 
         format: how should the reply be returned. Can be:
             'xml' (raw xml text),
-            'etree' (lxml.etree object), or
-            'obj' (lxml.objectify object).
+            'etree' (lxml.etree object),
+            'obj' (lxml.objectify object),
+            'stream' (gaereader.atom.AtomStream - entries parsed
+              incrementally, feed metadata in its feed attribute), or
+            'records' (gaereader.atom.AtomPage - list of compact Entry
+              records: id, title, links, published, updated, author,
+              plus the continuation).
           If not specified, 'obj' is default.
 
         count: how many articles to get (default 20),
@@ -165,6 +405,8 @@ class GoogleReaderClient(object):
         continue_from: start from given article instead of the first one
               (handle paging). Parameter given here should be taken from
                <gr:continuation> value from the reply obtained earlier.
+
+        deadline: time budget of the call (seconds or Deadline).
         """
         url = urllib.quote_plus(RE_FEED_ID_PREFIX.sub("", url))
         result = yield self._get_atom(GET_FEED_URL + url,
@@ -201,7 +443,8 @@ class GoogleReaderClient(object):
         Handles the same named parameters as get_feed_atom
         (format, count, older_first, continue_from).
         """
-        result = yield self.tag_id(tag)
+        deadline = kwargs['deadline'] = Deadline.coerce(kwargs.get('deadline'))
+        result = yield self.tag_id(tag, deadline = deadline and deadline.split(0.5))
         tagged_url = READING_TAG_URL % result
         result = yield self._get_atom(tagged_url, **kwargs)
         raise ndb.Return(result)
@@ -256,11 +499,49 @@ class GoogleReaderClient(object):
         result = yield self._get_atom(IN_STATE_URL % state, **kwargs)
         raise ndb.Return(result)
 
+    def iter_atom(self, source, page_size = 100, max_items = None,
+                  older_first = False, format = 'records', deadline = None):
+        """
+        Walks an Atom feed page by page, following the continuations.
+        source is a feed url (http(s)://... or feed/...), stream id
+        (user/-/label/News, user/-/state/com.google/starred...) or
+        a state name (as in get_instate_atom).
+
+        Returns gaereader.pager.Pager: iterate it to get the entries one
+        by one, or yield its next_page() in tasklets. The next page is
+        fetched while the current one is processed. At most max_items
+        entries are delivered (all of them if None).
+
+        format is 'records' (gaereader.atom.Entry records), 'etree' or
+        'obj' (entry elements).
+        """
+        if format not in ('records', 'etree', 'obj'):
+            raise ValueError("Unsupported format for iter_atom: %s" % format)
+        if source.startswith('user/'):
+            url = READING_TAG_URL % urllib.quote(source.encode('utf-8'), safe='/-')
+        elif source.startswith(('feed/', 'http://', 'https://')):
+            url = GET_FEED_URL + urllib.quote_plus(RE_FEED_ID_PREFIX.sub("", source))
+        else:
+            url = IN_STATE_URL % source
+        deadline = Deadline.coerce(deadline)
+
+        @ndb.tasklet
+        def fetch_page(continuation, count):
+            page = yield self._get_atom(url, count = count,
+                                        older_first = older_first,
+                                        continue_from = continuation,
+                                        format = format, deadline = deadline)
+            if format == 'records':
+                raise ndb.Return((page.entries, page.continuation))
+            raise ndb.Return((page.findall('{%s}entry' % ATOM_NS),
+                              page.findtext('{%s}continuation' % GR_NS)))
+        return Pager(fetch_page, page_size, max_items)
+
     ############################################################
     # Public API - item
 
     @ndb.tasklet
-    def search_for_articles(self, query, count=1000, tag=None):
+    def search_for_articles(self, query, count=1000, tag=None, deadline=None):
         """
         Searches for articles using given text query.
         Returns plain list like:
@@ -274,7 +555,8 @@ class GoogleReaderClient(object):
         (note that reader also sometimes uses long form
          'tag:google.com,2005:reader/item/5d0cfa30041d4348',
          every reader api which requires article id
-         should handle both forms fine)
+         should handle both forms fine, gaereader.itemids converts
+         between them)
         """
         output = "json"
         query = {
@@ -284,17 +566,19 @@ class GoogleReaderClient(object):
                 "ck": int(time.mktime(datetime.now().timetuple())),
                 "client": SOURCE,
                 }
+        deadline = Deadline.coerce(deadline)
         if tag is not None:
-          tag_id = yield self.tag_id(tag)
+          tag_id = yield self.tag_id(tag, deadline = deadline and deadline.split(0.5))
           query["s"] = tag_id.encode('utf-8')
         url = SEARCH_ITEMS_IDS_URL + "?"\
               + urllib.urlencode(query)
-        result = yield self._make_call(url)
+        result = yield self._make_call(url, deadline = deadline)
         reply = json.loads(result)
         raise ndb.Return([ item['id'] for item in reply['results'] ])
 
     @ndb.tasklet
-    def article_contents(self, ids):
+    def article_contents(self, ids, iter_items=False, fields=None,
+                         deadline=None):
         """
         Return article (entry) contents of specified articles. ids is
         a list of identifiers (for example extracted from feed, or
@@ -303,49 +587,294 @@ class GoogleReaderClient(object):
         Returned structure is a complicated recursive dictionary
         of which ['items'] list may be of biggest interest. Dump it for
         details.
+
+        fields (for example ['id', 'title', 'published']) reduces every
+        item to given keys.
+
+        With iter_items=True returns gaereader.jsonstream.JsonItemStream
+        instead, which decodes the items one at a time (other values
+        are in its meta).
         """
         url = STREAM_ITEMS_CONTENTS_URL + "?" \
               + urllib.urlencode({"ck": int(time.mktime(datetime.now().timetuple())),
                                   "client": SOURCE})
         post_params = [("i", id_) for id_ in ids]
         #post_params.extend([("it", "0")] * len(post_params))
-        result = yield self._get_token()
+        deadline = Deadline.coerce(deadline)
+        result = yield self._get_token(deadline = deadline and deadline.split(0.5))
         post_params.append(("T", result))
-        result = yield self._make_call(url, post_params)
-        raise ndb.Return(json.loads(result))
+        result = yield self._post_with_token(url, post_params, retry_safe = True,
+                                             deadline = deadline)
+        raise ndb.Return(self._parse_items(result, iter_items, fields))
 
     @ndb.tasklet
-    def contents(self, tag, count=20, older_first=False):
-        tag_id = yield self.tag_id(tag)
-        url = STREAM_CONTENTS_URL % urllib.quote_plus(tag_id.encode("utf-8")) + "?" \
-              + urllib.urlencode({
-                "ck": int(time.mktime(datetime.now().timetuple())),
-                "n": count,
-                "r": (older_first and "o" or "d"),
-                "client": SOURCE})
-        result = yield self._make_call(url)
-        raise ndb.Return(json.loads(result))
+    def contents(self, tag, count=20, older_first=False, continue_from=None,
+                 start_time=None, end_time=None, iter_items=False,
+                 fields=None, deadline=None):
+        """
+        Returns articles of given tag (parsed JSON).
+
+        continue_from: reply['continuation'] of the previous page, to
+              get the next one.
+
+        start_time, end_time: unix timestamps limiting the articles to
+              those crawled since start_time and before end_time
+              (Reader parameters ot and nt).
+
+        See article_contents for iter_items and fields, and
+        iter_contents for walking all the pages.
+        """
+        deadline = Deadline.coerce(deadline)
+        tag_id = yield self.tag_id(tag, deadline = deadline and deadline.split(0.5))
+        url = STREAM_CONTENTS_URL % urllib.quote_plus(tag_id.encode("utf-8"))
+        result = yield self._stream_contents(
+            url, count, older_first, continue_from, start_time, end_time,
+            deadline = deadline)
+        raise ndb.Return(self._parse_items(result, iter_items, fields))
 
     @ndb.tasklet
-    def feed_contents(self, feed_url, count=20, older_first=False):
+    def feed_contents(self, feed_url, count=20, older_first=False,
+                      continue_from=None, start_time=None, end_time=None,
+                      iter_items=False, fields=None, deadline=None):
         """
-        Returns list of articles belonging to given feed.
+        Returns list of articles belonging to given feed (see contents
+        for the parameters).
         """
-        url = STREAM_CONTENTS_FEED_URL % urllib.quote_plus(feed_url) + "?" \
-              + urllib.urlencode({
-                "ck": int(time.mktime(datetime.now().timetuple())),
-                "n": count,
-                "r": (older_first and "o" or "d"),
-                "client": SOURCE})
-        result = yield self._make_call(url)
-        raise ndb.Return(json.loads(result))
+        url = STREAM_CONTENTS_FEED_URL % urllib.quote_plus(feed_url)
+        result = yield self._stream_contents(
+            url, count, older_first, continue_from, start_time, end_time,
+            deadline = deadline)
+        raise ndb.Return(self._parse_items(result, iter_items, fields))
+
+    def iter_contents(self, tag = None, feed_url = None, page_size = 100,
+                      max_items = None, older_first = False,
+                      start_time = None, end_time = None, fields = None,
+                      deadline = None):
+        """
+        Walks the articles of tag (or of feed_url) page by page,
+        following the continuations, within the optional time window
+        (see contents). Suits incremental syncs: pass the time of the
+        previous sync as start_time.
+
+        Returns gaereader.pager.Pager (see iter_atom) delivering item
+        dictionaries (reduced to fields, if given). The next page is
+        fetched while the current one is processed.
+        """
+        if (tag is None) == (feed_url is None):
+            raise ValueError("Give either tag or feed_url")
+        deadline = Deadline.coerce(deadline)
+        stream_url = []
+
+        @ndb.tasklet
+        def fetch_page(continuation, count):
+            if not stream_url:
+                if tag is not None:
+                    tag_id = yield self.tag_id(
+                        tag, deadline = deadline and deadline.split(0.5))
+                    stream_url.append(STREAM_CONTENTS_URL
+                                      % urllib.quote_plus(tag_id.encode("utf-8")))
+                else:
+                    stream_url.append(STREAM_CONTENTS_FEED_URL
+                                      % urllib.quote_plus(feed_url))
+            result = yield self._stream_contents(
+                stream_url[0], count, older_first, continuation,
+                start_time, end_time, deadline = deadline)
+            stream = JsonItemStream(result, fields)
+            items = list(stream)
+            raise ndb.Return((items, stream.continuation))
+        return Pager(fetch_page, page_size, max_items)
+
+    def _stream_contents(self, url, count, older_first, continue_from,
+                         start_time, end_time, deadline = None):
+        args = {
+            "ck": int(time.mktime(datetime.now().timetuple())),
+            "n": count,
+            "r": (older_first and "o" or "d"),
+            "client": SOURCE}
+        if continue_from:
+            args["c"] = continue_from
+        if start_time is not None:
+            args["ot"] = int(start_time)
+        if end_time is not None:
+            args["nt"] = int(end_time)
+        return self._make_call(url + "?" + urllib.urlencode(args),
+                               deadline = deadline)
+
+    def fetch_feeds(self, feed_urls, count = 20, format = 'obj',
+                    max_concurrency = 10, deadline = None):
+        """
+        Fetches many feeds, at most max_concurrency at once, delivering
+        them as they arrive (not in the order of feed_urls).
+
+        format is one of get_feed_atom formats, or 'json' for the parsed
+        feed_contents reply.
+
+        Returns ndb.QueueFuture of FeedResult (feed_url, result, error)
+        tuples, error being the exception if the feed failed:
+
+            queue = client.fetch_feeds(urls)
+            while True:
+                try:
+                    feed = yield queue.getq()
+                except EOFError:
+                    break
+                ...
+
+        (outside tasklets use queue.getq().get_result()).
+        """
+        deadline = Deadline.coerce(deadline)
+        queue = ndb.QueueFuture()
+        feed_urls = list(feed_urls)
+        pending = iter(feed_urls)
+
+        def fetch(feed_url):
+            if format == 'json':
+                return self.feed_contents(feed_url, count = count,
+                                          deadline = deadline)
+            return self.get_feed_atom(feed_url, count = count,
+                                      format = format, deadline = deadline)
+
+        @ndb.tasklet
+        def worker():
+            for feed_url in pending:
+                try:
+                    result = yield fetch(feed_url)
+                    queue.putq(FeedResult(feed_url, result, None))
+                except Exception, e:
+                    queue.putq(FeedResult(feed_url, None, e))
+
+        @ndb.tasklet
+        def run():
+            try:
+                yield [worker() for _ in
+                       xrange(min(max_concurrency, len(feed_urls)))]
+            finally:
+                queue.complete()
+
+        run()
+        return queue
+
+    @ndb.tasklet
+    def feed_contents_columns(self, feed_urls, count=20, older_first=False,
+                              max_concurrency=10, deadline=None):
+        """
+        Fetches the articles of many feeds (at most max_concurrency
+        at once) into one gaereader.columns.ItemColumns, ready to be
+        sorted and filtered across the feeds.
+
+        Returns pair (columns, errors), errors being dictionary
+        feed_url -> exception for the feeds which could not be fetched
+        or decoded (items decoded before the error are kept).
+        """
+        deadline = Deadline.coerce(deadline)
+        feed_urls = list(feed_urls)
+        def fetch(feed_url):
+            return self.feed_contents(feed_url, count = count,
+                                      older_first = older_first,
+                                      iter_items = True, deadline = deadline)
+        results = yield _bounded_map(fetch, feed_urls, max_concurrency)
+        columns = ItemColumns()
+        errors = {}
+        for feed_url, (stream, error) in zip(feed_urls, results):
+            if error is not None:
+                errors[feed_url] = error
+                continue
+            try:
+                columns.extend(stream)
+            except (ValueError, KeyError), e:
+                errors[feed_url] = GoogleOperationFailed(e)
+        raise ndb.Return((columns, errors))
+
+    def _parse_items(self, content, iter_items, fields):
+        if iter_items:
+            return JsonItemStream(content, fields)
+        reply = json.loads(content)
+        if fields is not None:
+            reply['items'] = [dict((name, item[name]) for name in fields
+                                   if name in item)
+                              for item in reply.get('items', ())]
+        return reply
+
+
+
+    @ndb.tasklet
+    def edit_item_tags(self, items, add_tags = (), remove_tags = (),
+                       max_items = EDIT_TAG_MAX_ITEMS, deadline = None):
+        """
+        Adds and/or removes tags (labels or states like STATE_READ) of
+        many articles at once.
+
+        items are article identifiers (short or long form), or
+        (identifier, stream id) pairs, for example
+        (u'-8654279325215116158', u'feed/http://example.com/rss').
 
+        add_tags and remove_tags are lists of tag names or ids.
+
+        Items are packed into as few requests as possible (up to
+        max_items and EDIT_TAG_MAX_BYTES per request), which are sent
+        concurrently with one shared token.
+        """
+        url = TAG_EDIT_URL + '?client=%s' % SOURCE
+        deadline = Deadline.coerce(deadline)
+        lookup_deadline = deadline and deadline.split(0.5)
+        add_ids = yield [self.tag_id(tag, deadline = lookup_deadline)
+                         for tag in add_tags]
+        remove_ids = yield [self.tag_id(tag, deadline = lookup_deadline)
+                            for tag in remove_tags]
+        common = [('a', tag) for tag in add_ids] \
+                 + [('r', tag) for tag in remove_ids] \
+                 + [('async', u'true')]
+        token = yield self._get_token(deadline = lookup_deadline)
+        common.append(('T', token))
+
+        requests = []
+        for chunk in _pack_item_params(items, common, max_items):
+            requests.append(self._post_with_token(url, chunk, retry_safe = True,
+                                                  deadline = deadline))
+        replies = yield requests
+        if [reply for reply in replies if reply != "OK"]:
+            raise GoogleOperationFailed
+        return
+
+    @ndb.tasklet
+    def mark_read(self, items, deadline = None):
+        """
+        Marks articles as read. See edit_item_tags for items format.
+        """
+        yield self.edit_item_tags(items, add_tags = [STATE_READ],
+                                  remove_tags = [STATE_KEPT_UNREAD],
+                                  deadline = deadline)
+
+    @ndb.tasklet
+    def mark_unread(self, items, deadline = None):
+        """
+        Marks articles as unread (kept-unread).
+        """
+        yield self.edit_item_tags(items, add_tags = [STATE_KEPT_UNREAD],
+                                  remove_tags = [STATE_READ],
+                                  deadline = deadline)
+
+    @ndb.tasklet
+    def star(self, items, deadline = None):
+        """
+        Stars articles.
+        """
+        yield self.edit_item_tags(items, add_tags = [STATE_STARRED],
+                                  deadline = deadline)
+
+    @ndb.tasklet
+    def unstar(self, items, deadline = None):
+        """
+        Removes star from articles.
+        """
+        yield self.edit_item_tags(items, remove_tags = [STATE_STARRED],
+                                  deadline = deadline)
 
     ############################################################
     # Public API - subscription info
 
     @ndb.tasklet
-    def get_subscription_list(self, format = 'obj'):
+    def get_subscription_list(self, format = 'obj', deadline = None):
         """
         Returns info about all subscribed feeds.
 
@@ -355,29 +884,29 @@ class GoogleReaderClient(object):
 
         If format = 'obj', returns parsed JSON (python dictionary)
         """
-        result = yield self._get_list(SUBSCRIPTION_LIST_URL, format)
+        result = yield self._get_list(SUBSCRIPTION_LIST_URL, format, deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def get_tag_list(self, format = 'obj'):
-        result = yield self._get_list(TAG_LIST_URL, format)
+    def get_tag_list(self, format = 'obj', deadline = None):
+        result = yield self._get_list(TAG_LIST_URL, format, deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def get_preference_list(self, format = 'obj'):
-        result = yield self._get_list(PREFERENCE_LIST_URL, format)
+    def get_preference_list(self, format = 'obj', deadline = None):
+        result = yield self._get_list(PREFERENCE_LIST_URL, format, deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def get_unread_count(self, format = 'obj'):
-        result = yield self._get_list(UNREAD_COUNT_URL, format)
+    def get_unread_count(self, format = 'obj', deadline = None):
+        result = yield self._get_list(UNREAD_COUNT_URL, format, deadline)
         raise ndb.Return(result)
 
     ############################################################
     # Public API - subscription modifications
 
     @ndb.tasklet
-    def subscribe_quickadd(self, site_url):
+    def subscribe_quickadd(self, site_url, deadline = None):
         """
         Subscribe to given site url.
 
@@ -404,43 +933,47 @@ class GoogleReaderClient(object):
         url = SUBSCRIPTION_QUICKADD_URL + "?" \
               + urllib.urlencode({"ck": int(time.mktime(datetime.now().timetuple())),
                                   "client": SOURCE})
-        result = yield self._get_token()
+        deadline = Deadline.coerce(deadline)
+        result = yield self._get_token(deadline = deadline and deadline.split(0.5))
         post_params = {
             "quickadd": site_url,
             "T": result,
             }
-        result = yield self._make_call(url, post_params)
+        result = yield self._post_with_token(url, post_params, deadline = deadline)
         raise ndb.Return(json.loads(result))
 
     @ndb.tasklet
-    def subscribe_feed(self, feed_url, title = None):
+    def subscribe_feed(self, feed_url, title = None, deadline = None):
         """
         Subscribe to given feed. Optionally set title.
 
         Note: feed should specify RSS/Atom url. See subscribe_quickadd for
         alternate method.
         """
-        result = yield self._change_feed(feed_url, 'subscribe', title = title)
+        result = yield self._change_feed(feed_url, 'subscribe', title = title,
+                                         deadline = deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def unsubscribe_feed(self, feed_url):
+    def unsubscribe_feed(self, feed_url, deadline = None):
         """
         Unsubscribe from the given feed.
         """
-        result = yield self._change_feed(feed_url, 'unsubscribe')
+        result = yield self._change_feed(feed_url, 'unsubscribe',
+                                         deadline = deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def change_feed_title(self, feed_url, title):
+    def change_feed_title(self, feed_url, title, deadline = None):
         """
         Changes the feed title
         """
-        result = yield self._change_feed(feed_url, 'edit', title = title)
+        result = yield self._change_feed(feed_url, 'edit', title = title,
+                                         deadline = deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def add_feed_tag(self, feed_url, title, tag):
+    def add_feed_tag(self, feed_url, title, tag, deadline = None):
         """
         Adds feed to new tag (folder).
         Tag can be specified either as full id copied from the tag list
@@ -449,32 +982,106 @@ class GoogleReaderClient(object):
         
         It seems that tag may be new (not-yet-existant tags do work)
         """
-        result = yield self._change_tag(feed_url, title, add_tag = tag)
+        result = yield self._change_tag(feed_url, title, add_tag = tag,
+                                        deadline = deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def remove_feed_tag(self, feed_url, title, tag):
+    def remove_feed_tag(self, feed_url, title, tag, deadline = None):
         """
         Removes feed from given tag (folder).
         Tag can be specified either as full id copied from the tag list
         (say "user/04686467480557924617/label/\u017bycie: Polityka")
         or as the sole name ("Życie: Polityka")
         """
-        result = yield self._change_tag(feed_url, title, remove_tag = tag)
+        result = yield self._change_tag(feed_url, title, remove_tag = tag,
+                                        deadline = deadline)
         raise ndb.Return(result)
 
     @ndb.tasklet
-    def disable_tag(self, tag):
+    def subscribe_many(self, feeds, max_concurrency = 10, deadline = None):
+        """
+        Subscribes to many feeds. feeds is an iterable of feed urls or
+        (url, title, tags) tuples (title and tags optional, tags being
+        list of tag names or ids).
+
+        Tag ids and the token are obtained once, then subscriptions are
+        sent, at most max_concurrency at once. Returns list of
+        FeedEditResult (feed_url, error) in the order of feeds, error
+        being None on success.
+        """
+        deadline = Deadline.coerce(deadline)
+        lookup_deadline = deadline and deadline.split(0.2)
+        edits = []
+        for feed in feeds:
+            if isinstance(feed, basestring):
+                feed = (feed,)
+            url, title, tags = (tuple(feed) + (None, None))[:3]
+            if isinstance(tags, basestring):
+                tags = [tags]
+            edits.append((url, title, tags or []))
+
+        names = set(tag for _, _, tags in edits for tag in tags)
+        ids = yield [self.tag_id(tag, deadline = lookup_deadline)
+                     for tag in names]
+        tag_ids = dict(zip(names, ids))
+        token = yield self._get_token(deadline = lookup_deadline)
+
+        def subscribe(edit):
+            url, title, tags = edit
+            return self._edit_subscription(
+                url, 'subscribe', title = title,
+                add_tags = [tag_ids[tag] for tag in tags],
+                token = token, deadline = deadline)
+        results = yield _bounded_map(subscribe, edits, max_concurrency)
+        raise ndb.Return([FeedEditResult(edit[0], error)
+                          for edit, (_, error) in zip(edits, results)])
+
+    @ndb.tasklet
+    def unsubscribe_many(self, feed_urls, max_concurrency = 10, deadline = None):
+        """
+        Unsubscribes from many feeds, at most max_concurrency at once.
+        Returns list of FeedEditResult like subscribe_many.
+        """
+        feed_urls = list(feed_urls)
+        deadline = Deadline.coerce(deadline)
+        token = yield self._get_token(deadline = deadline and deadline.split(0.2))
+
+        def unsubscribe(url):
+            return self._edit_subscription(url, 'unsubscribe', token = token,
+                                           deadline = deadline)
+        results = yield _bounded_map(unsubscribe, feed_urls, max_concurrency)
+        raise ndb.Return([FeedEditResult(url, error)
+                          for url, (_, error) in zip(feed_urls, results)])
+
+    def edit_buffer(self, max_pending = 50, max_delay = 5.0):
+        """
+        Returns SubscriptionEditBuffer: object with the same
+        subscribe_feed, unsubscribe_feed, change_feed_title, add_feed_tag
+        and remove_feed_tag methods, which queues the changes and later
+        sends them merged, one subscription/edit request per feed:
+
+            buf = client.edit_buffer()
+            buf.add_feed_tag(feed, title, "News")
+            buf.remove_feed_tag(feed, title, "Later")
+            for feed_url, error in buf.flush().get_result():
+                ...
+        """
+        return SubscriptionEditBuffer(self, max_pending, max_delay)
+
+    @ndb.tasklet
+    def disable_tag(self, tag, deadline = None):
         """
         Removes tag as a whole
         """
         url = TAG_DISABLE_URL + '?client=%s' % SOURCE
-        result = yield self.tag_id(tag)
+        deadline = Deadline.coerce(deadline)
+        result = yield self.tag_id(tag, deadline = deadline and deadline.split(0.5))
         post_data = {
             's' : result,
             'ac' : 'disable-tags',
             }
-        reply = yield self._make_call(url, post_data)
+        reply = yield self._make_call(url, post_data, deadline = deadline)
         if reply != "OK":
             raise GoogleOperationFailed
         return
@@ -496,15 +1103,14 @@ class GoogleReaderClient(object):
             'continue': GOOGLE_URL, 
             }
         post_data = urllib.urlencode(post_params) 
-        request = urllib2.Request(LOGIN_URL, post_data, header)
 
         if log.isEnabledFor("info"):
             pdcopy = post_params.copy()
             pdcopy['Passwd'] = '*******'
             log.info("Calling %s with parameters:\n    %s" % (
-                        request.get_full_url(), str(pdcopy)))
+                        LOGIN_URL, str(pdcopy)))
 
-        result = yield ndb.get_context().urlfetch(LOGIN_URL, payload=request.data, method=urlfetch.POST, headers=request.headers)
+        result = yield self.transport.fetch(LOGIN_URL, payload=post_data, method=POST, headers=header)
         if result.status_code == 403:
             raise GoogleLoginFailed("%s (%s)" % (result, result.content))
         elif result.status_code != 200:
@@ -517,30 +1123,160 @@ class GoogleReaderClient(object):
             raise GoogleLoginFailed
         raise ndb.Return(sid)
 
+    def _ensure_session(self):
+        """
+        Starts the session unless already started. Concurrent callers
+        share one start. Returns future.
+        """
+        if self.session_id is not None:
+            future = ndb.Future()
+            future.set_result(self.session_id)
+            return future
+        flights = self._flights
+        if flights.session is None:
+            flights.session = self._start_session()
+        return flights.session
+
     @ndb.tasklet
-    def _get_token(self):
+    def _start_session(self):
+        """
+        Restores the session from session_store, or logs in.
+        """
+        try:
+            session = None
+            if self.session_store is not None:
+                session = yield self.session_store.get(self.login)
+            if session and session.get('session_id'):
+                log.debug("Reusing stored session of %s" % self.login)
+                self.session_id = session['session_id']
+                self.my_id = session.get('my_id') or '-'
+                if session.get('token'):
+                    self.cached_token = session['token']
+                    self.cached_token_time = session.get('token_time') or 0
+            else:
+                yield self._renew_session(None)
+        finally:
+            self._flights.session = None
+        raise ndb.Return(self.session_id)
+
+    def _renew_session(self, stale_session_id):
+        """
+        Logs in again, unless the session already changed since
+        stale_session_id was used. Concurrent callers share one login.
+        Returns future.
+        """
+        if self.session_id is not None and self.session_id != stale_session_id:
+            future = ndb.Future()
+            future.set_result(self.session_id)
+            return future
+        flights = self._flights
+        if flights.login is None:
+            flights.login = self._login()
+        return flights.login
+
+    @ndb.tasklet
+    def _login(self):
+        try:
+            if self.session_id is not None and self.session_store is not None:
+                yield self.session_store.delete(self.login)
+            session_id = yield self._get_session_id(self.login, self._password)
+        finally:
+            self._flights.login = None
+        self.session_id = session_id
+        self.cached_token = None
+        self.cached_token_time = 0
+        yield self._save_session()
+        raise ndb.Return(session_id)
+
+    @ndb.tasklet
+    def _save_session(self):
+        if self.session_store is not None and self.session_id is not None:
+            yield self.session_store.put(self.login, {
+                'session_id': self.session_id,
+                'my_id': self.my_id,
+                'token': self.cached_token,
+                'token_time': self.cached_token_time,
+                })
+
+    @ndb.tasklet
+    def _get_token(self, deadline = None, force = False):
         """
         Obtain the call protection token
+
+        Concurrent callers share one token fetch. Token close to expiry
+        is returned while a fresh one is fetched in background. force
+        skips the cached token (after Google rejected it).
         """
         # Token jest jakiś czas ważny...
-        t = time.time()
-        if t - self.cached_token_time > TOKEN_VALID_TIME:
-            self.cached_token = yield self._make_call(TOKEN_URL)
-            self.cached_token_time = t
+        age = time.time() - self.cached_token_time
+        if force or age > TOKEN_VALID_TIME:
+            token = yield self._refresh_token(deadline)
+            raise ndb.Return(token)
+        if age > TOKEN_VALID_TIME - TOKEN_REFRESH_MARGIN:
+            self._refresh_token()
         raise ndb.Return(self.cached_token)
 
+    def _refresh_token(self, deadline = None):
+        """
+        Starts fetching new token, unless it is already being fetched.
+        Returns the future of the fetch.
+        """
+        flights = self._flights
+        if flights.token is None:
+            flights.token = self._fetch_token(deadline)
+        return flights.token
+
+    @ndb.tasklet
+    def _fetch_token(self, deadline = None):
+        t = time.time()
+        try:
+            token = yield self._make_call(TOKEN_URL, deadline = deadline)
+        finally:
+            self._flights.token = None
+        self.cached_token = token
+        self.cached_token_time = t
+        yield self._save_session()
+        raise ndb.Return(token)
+
+    @ndb.tasklet
+    def _post_with_token(self, url, post_data, retry_safe = False, deadline = None):
+        """
+        _make_call for POSTs protected by the token (post_data holds it
+        under 'T'). If Google rejects the token, new one is fetched and
+        the call is replayed once.
+        """
+        url = url.encode('utf-8')
+        deadline = Deadline.coerce(deadline)
+        result = yield self._call(url, post_data, retry_safe = retry_safe,
+                                  deadline = deadline)
+        if result.status_code == 401 and result.header('x-reader-google-bad-token'):
+            log.info("Token rejected, fetching new one")
+            self.stats.incr('bad_token')
+            token = yield self._get_token(deadline = deadline, force = True)
+            if type(post_data) is list:
+                post_data = [(key, token if key == 'T' else value)
+                             for key, value in post_data]
+            else:
+                post_data = dict(post_data, T = token)
+            result = yield self._call(url, post_data, retry_safe = retry_safe,
+                                      deadline = deadline)
+        raise ndb.Return(result.content)
+
     @ndb.tasklet
     def _get_atom(self, url, count = None, 
-                  older_first = False, continue_from = None, format = 'obj'):
+                  older_first = False, continue_from = None, format = 'obj',
+                  deadline = None):
         """
         Actually get ATOM feed. url is base url (one of the state or label urls).
         count is the articles count (default 20), older_first set to True means older
         first, continue_from can be set to gr:continuation value from the feed to
         grab more items
 
-        format can be 'xml' (raw xml text), 'etree' (lxml.etree) or 'obj'
-        (lxml.objectify - default)
+        format can be 'xml' (raw xml text), 'etree' (lxml.etree), 'obj'
+        (lxml.objectify - default), 'stream' (AtomStream) or 'records'
+        (AtomPage)
         """
+        deadline = Deadline.coerce(deadline)
         args = {}
         if count is not None:
             args['n'] = "%d" % count
@@ -550,23 +1286,53 @@ class GoogleReaderClient(object):
             args['c'] = continue_from
         if args:
             url = url.encode('utf-8') + '?' + urllib.urlencode(args)
-        r = yield self._make_call(url)
+        # Continuation pages are fetched once while paging, caching them
+        # would only hold their trees in memory
+        cache = not continue_from
+        if format == 'stream':
+            # Every caller gets its own (single use) stream over the
+            # shared text
+            result = yield self._get_atom_text(url, cache, deadline)
+            raise ndb.Return(AtomStream(result, self.huge_tree))
+        result = yield self._single_flight(
+            ('atom', url, format),
+            lambda: self._fetch_atom(url, format, cache, deadline), deadline)
+        raise ndb.Return(result)
+
+    def _get_atom_text(self, url, cache = True, deadline = None):
+        return self._single_flight(
+            ('atom', url, 'xml'),
+            lambda: self._fetch_atom(url, 'xml', cache, deadline), deadline)
+
+    @ndb.tasklet
+    def _fetch_atom(self, url, format, cache = True, deadline = None):
+        result = yield self._conditional_get(
+            url, format, lambda r: self._parse_atom(r, format), deadline,
+            cache = cache)
+        raise ndb.Return(result)
+
+    def _parse_atom(self, r, format):
         try:
+            started = time.time()
             if format == "obj":
-                raise ndb.Return(objectify.fromstring(r))
+                result = objectify.fromstring(r, get_parser('obj', self.huge_tree))
             elif format == "etree":
-                raise ndb.Return(etree.XML(r))
+                result = etree.XML(r, get_parser('etree', self.huge_tree))
+            elif format == "records":
+                result = AtomPage.parse(r, self.huge_tree)
             else:
-                raise ndb.Return(r)
-        except ndb.Return:
-            raise
+                return r
+            self.stats.incr('pages_parsed')
+            self.stats.incr('parse_seconds', time.time() - started)
+            return result
         except Exception, e:
             logging.error(r)
             raise GoogleOperationFailed(e)
 
     @ndb.tasklet
     def _change_feed(self, feed_url, operation,
-                     title = None, add_tag = None, remove_tag = None):
+                     title = None, add_tag = None, remove_tag = None,
+                     deadline = None):
         """
         Subscribe or unsubscribe
         """
@@ -574,7 +1340,9 @@ class GoogleReaderClient(object):
         if not feed_url.startswith(prefix):
           feed_url = prefix + feed_url
         url = SUBSCRIPTION_EDIT_URL + '?client=%s' % SOURCE
-        result = yield self._get_token()
+        deadline = Deadline.coerce(deadline)
+        lookup_deadline = deadline and deadline.split(0.5)
+        result = yield self._get_token(deadline = lookup_deadline)
         post_data = { 
             'ac' : operation,
             's' : feed_url,
@@ -583,16 +1351,47 @@ class GoogleReaderClient(object):
         if title:
             post_data['t'] = title
         if add_tag:
-            post_data['a'] = yield self.tag_id(add_tag)
+            post_data['a'] = yield self.tag_id(add_tag, deadline = lookup_deadline)
         if remove_tag:
-            post_data['r'] = yield self.tag_id(remove_tag)
-        reply = yield self._make_call(url, post_data)
+            post_data['r'] = yield self.tag_id(remove_tag, deadline = lookup_deadline)
+        reply = yield self._post_with_token(url, post_data, deadline = deadline)
         if reply != "OK":
             raise GoogleOperationFailed
         return
 
     @ndb.tasklet
-    def _change_tag(self, feed_url, title, add_tag = None, remove_tag = None):
+    def _edit_subscription(self, feed_url, operation, title = None,
+                           add_tags = (), remove_tags = (), token = None,
+                           deadline = None):
+        """
+        Single subscription/edit call, adding and removing any number
+        of tags at once. token may be given if already obtained.
+        """
+        if not feed_url.startswith("feed/"):
+          feed_url = "feed/" + feed_url
+        url = SUBSCRIPTION_EDIT_URL + '?client=%s' % SOURCE
+        deadline = Deadline.coerce(deadline)
+        lookup_deadline = deadline and deadline.split(0.5)
+        add_ids = yield [self.tag_id(tag, deadline = lookup_deadline)
+                         for tag in add_tags]
+        remove_ids = yield [self.tag_id(tag, deadline = lookup_deadline)
+                            for tag in remove_tags]
+        if token is None:
+            token = yield self._get_token(deadline = lookup_deadline)
+        post_data = [('ac', operation), ('s', feed_url)]
+        if title:
+            post_data.append(('t', title))
+        post_data.extend(('a', tag) for tag in add_ids)
+        post_data.extend(('r', tag) for tag in remove_ids)
+        post_data.append(('T', token))
+        reply = yield self._post_with_token(url, post_data, deadline = deadline)
+        if reply != "OK":
+            raise GoogleOperationFailed
+        return
+
+    @ndb.tasklet
+    def _change_tag(self, feed_url, title, add_tag = None, remove_tag = None,
+                    deadline = None):
         """
         Subscribe or unsubscribe
         """
@@ -601,7 +1400,9 @@ class GoogleReaderClient(object):
           feed_url = prefix + feed_url
         #url = TAG_EDIT_URL + '?client=%s' % SOURCE
         url = SUBSCRIPTION_EDIT_URL + '?client=%s' % SOURCE
-        result = yield self._get_token()
+        deadline = Deadline.coerce(deadline)
+        lookup_deadline = deadline and deadline.split(0.5)
+        result = yield self._get_token(deadline = lookup_deadline)
         post_data = { 
             'ac' : 'edit',
             's' : feed_url,
@@ -609,10 +1410,10 @@ class GoogleReaderClient(object):
             'T' : result,
             }
         if add_tag:
-            post_data['a'] = yield self.tag_id(add_tag)
+            post_data['a'] = yield self.tag_id(add_tag, deadline = lookup_deadline)
         if remove_tag:
-            post_data['r'] = yield self.tag_id(remove_tag)
-        reply = yield self._make_call(url, post_data)
+            post_data['r'] = yield self.tag_id(remove_tag, deadline = lookup_deadline)
+        reply = yield self._post_with_token(url, post_data, deadline = deadline)
         if reply != "OK":
             raise GoogleOperationFailed
 
@@ -631,17 +1432,128 @@ class GoogleReaderClient(object):
         return
 
     @ndb.tasklet
-    def _get_list(self, url, format):
+    def _get_list(self, url, format, deadline = None):
+        deadline = Deadline.coerce(deadline)
+        result = yield self._single_flight(
+            ('list', url, format),
+            lambda: self._fetch_list(url, format, deadline), deadline)
+        raise ndb.Return(result)
+
+    @ndb.tasklet
+    def _fetch_list(self, url, format, deadline = None):
         if format == 'obj':
-            result = yield self._make_call(url + '?output=json')
-            raise ndb.Return(json.loads(result))
+            result = yield self._conditional_get(url + '?output=json',
+                                                 format, json.loads, deadline)
         else:
-            result = yield self._make_call(url + '?output=' + format)
-            raise ndb.Return(result)
-        
+            result = yield self._conditional_get(url + '?output=' + format,
+                                                 format, lambda r: r, deadline)
+        raise ndb.Return(result)
 
     @ndb.tasklet
-    def _make_call(self, url, post_data=None):
+    def _conditional_get(self, url, format, parse, deadline = None,
+                         cache = True):
+        """
+        GET url sending the validators remembered in validator_cache.
+        Returns parse(content), or on 304 Not Modified the object parsed
+        previously (parsing the cached content if this format was not
+        requested before). With cache=False it is a plain GET, and the
+        reply is not remembered.
+        """
+        url = url.encode('utf-8')
+        if not cache:
+            result = yield self._single_flight(
+                ('call', url, None),
+                lambda: self._call(url, deadline = deadline), deadline)
+            raise ndb.Return(parse(result.content))
+        entry = self.validator_cache.get(url)
+        headers = entry and entry.request_headers() or None
+        key = ('call', url, headers and tuple(sorted(headers.items())))
+        result = yield self._single_flight(
+            key, lambda: self._call(url, headers = headers, deadline = deadline),
+            deadline)
+
+        if result.status_code == 304 and entry is not None:
+            log.debug("Not modified: %s" % url)
+            if format not in entry.parsed:
+                entry.parsed[format] = parse(entry.content)
+            raise ndb.Return(entry.parsed[format])
+
+        parsed = parse(result.content)
+        etag = result.header('etag')
+        last_modified = result.header('last-modified')
+        if result.status_code == 200 and (etag or last_modified):
+            entry = CachedReply(etag, last_modified, result.content)
+            entry.parsed[format] = parsed
+            self.validator_cache.put(url, entry)
+        else:
+            self.validator_cache.discard(url)
+        raise ndb.Return(parsed)
+
+    def _single_flight(self, key, factory, deadline = None):
+        """
+        Returns the future of the call identified by key. If the same call
+        is already in flight in this thread, its future is shared (so
+        concurrent callers get one fetch and one parsed result),
+        otherwise factory() is called to start it (under deadline).
+
+        A call started under a deadline is shared only by callers whose
+        deadline is not looser, others start their own. A caller sharing
+        the call waits for it only until its own deadline, then gets
+        GoogleDeadlineExceeded.
+
+        The shared result is the very same object for all callers, so
+        it should be treated as read-only.
+        """
+        in_flight = self._flights.calls
+        flight = in_flight.get(key)
+        if flight is not None:
+            future, started_under = flight
+            if started_under is None or (
+                    deadline is not None
+                    and deadline.expires <= started_under.expires):
+                return self._wait_within(future, deadline, key[1])
+        future = factory()
+        if not future.done():
+            # Replaces the flight of tighter deadline, if any
+            in_flight[key] = (future, deadline)
+
+            def landed():
+                if in_flight.get(key, (None,))[0] is future:
+                    del in_flight[key]
+            future.add_immediate_callback(landed)
+        return future
+
+    def _wait_within(self, future, deadline, url):
+        """
+        Future of the result of future, failing with GoogleDeadlineExceeded
+        if it does not arrive within deadline (if any).
+        """
+        if deadline is None:
+            return future
+        waiter = ndb.Future('GoogleReaderClient._wait_within')
+
+        def settle():
+            if waiter.done():
+                return
+            if future.done():
+                exception = future.get_exception()
+                if exception is None:
+                    waiter.set_result(future.get_result())
+                else:
+                    waiter.set_exception(exception, future.get_traceback())
+            elif deadline.expired:
+                self.stats.incr('deadline_exceeded')
+                waiter.set_exception(GoogleDeadlineExceeded(
+                        "No time left waiting for %s" % url))
+            else:
+                eventloop.queue_call(
+                    min(DEADLINE_POLL_INTERVAL, deadline.remaining()), settle)
+        future.add_immediate_callback(settle)
+        settle()
+        return waiter
+
+    @ndb.tasklet
+    def _make_call(self, url, post_data=None, retry_safe=False, deadline=None):
         """
         Actually executes a call to given url, adding authorization headers
         and parameters.
@@ -649,9 +1561,120 @@ class GoogleReaderClient(object):
         post_data can be either a dictionary, or list of (key, value)
         pairs. In both cases value should be unicode (and will be encoded
         to utf-8 inside this method).
+
+        Identical GET calls issued while one is still in flight share
+        a single fetch. GET calls are retried on transient failures,
+        POST calls only if retry_safe is set.
+
+        deadline (seconds or Deadline) limits the time of the call,
+        including retries.
+        """
+        url = url.encode('utf-8')
+        deadline = Deadline.coerce(deadline)
+        if post_data is None:
+            result = yield self._single_flight(
+                ('call', url), lambda: self._call(url, deadline = deadline),
+                deadline)
+        else:
+            result = yield self._call(url, post_data, retry_safe = retry_safe,
+                                      deadline = deadline)
+        raise ndb.Return(result.content)
+
+    @ndb.tasklet
+    def _call(self, url, post_data=None, headers=None, retry_safe=False,
+              deadline=None):
+        """
+        HTTP call through the transport, guarded by the circuit breaker
+        of the endpoint family and retried according to retry_policy
+        (within deadline, if given). Returns the Response.
+        """
+        family = endpoint_family(url)
+        breaker = self.circuit_breakers.get(family)
+        if post_data is None or retry_safe:
+            policy = self.retry_policy
+        else:
+            policy = NO_RETRY
+        if self.session_id is None:
+            yield self._ensure_session()
+        started = time.time()
+        attempts = 0
+        relogged = False
+        while True:
+            if not breaker.allow():
+                self.stats.incr('circuit_open')
+                raise GoogleServiceUnavailable(
+                    "Too many failures of %s calls, not calling %s" % (family, url))
+            yield self.rate_limiter.acquire(family, self.login)
+            self._check_deadline(deadline, url)
+            started_call = yield self.concurrency.acquire(self.login)
+            # Waiting for the slot took some of the time as well
+            timeout = None
+            if deadline is not None:
+                timeout = deadline.remaining()
+                if timeout <= 0:
+                    self.concurrency.cancel()
+                    self._check_deadline(deadline, url)
+            attempts += 1
+            error = None
+            overloaded = False
+            session_id = self.session_id
+            try:
+                result = yield self._send(url, post_data, headers, timeout,
+                                          retry_safe)
+            except TIMEOUT_ERRORS, e:
+                error = e
+                overloaded = True
+            except TRANSIENT_ERRORS, e:
+                error = e
+            else:
+                overloaded = result.status_code in OVERLOAD_STATUS
+            finally:
+                self.concurrency.release(started_call, overloaded)
+            if error is None and result.status_code not in TRANSIENT_STATUS:
+                breaker.record_success()
+                if result.status_code in (401, 403) and not relogged \
+                        and not result.header('x-reader-google-bad-token'):
+                    log.info("Session rejected (%d), logging in again" % result.status_code)
+                    self.stats.incr('relogins')
+                    relogged = True
+                    yield self._renew_session(session_id)
+                    continue
+                raise ndb.Return(result)
+            delay = policy.backoff(attempts, time.time() - started)
+            if delay is not None and deadline is not None \
+                    and delay >= deadline.remaining():
+                delay = None
+            if delay is None:
+                # The breaker counts failed calls, not attempts, so that
+                # retries of one call can not open it
+                breaker.record_failure()
+                if error is not None:
+                    raise error
+                raise urllib2.HTTPError(result.final_url, result.status_code, None, result.headers, StringIO(result.content))
+            log.warning("Call to %s failed (%s), retrying in %.2fs" % (
+                    url, error or result.status_code, delay))
+            self.stats.incr('retries')
+            yield ndb.sleep(delay)
+
+    def _check_deadline(self, deadline, url):
+        if deadline is not None and deadline.expired:
+            self.stats.incr('deadline_exceeded')
+            raise GoogleDeadlineExceeded("No time left to call %s" % url)
+
+    @ndb.tasklet
+    def _send(self, url, post_data=None, headers=None, timeout=None,
+              retry_safe=False):
+        """
+        Single HTTP call through the transport, returns the Response.
+        headers are added to the standard ones, timeout (seconds) is
+        passed to the transport as the call deadline, retry_safe tells
+        it whether the POST may be sent again.
         """
         header = {'User-agent' : SOURCE}
         header['Authorization'] = 'GoogleLogin auth=%s' % self.session_id
+        header['Accept-Encoding'] = ACCEPT_ENCODING
+        if headers:
+            header.update(headers)
         if post_data is not None:
             if type(post_data) is list:
                 true_data = [
@@ -662,22 +1685,24 @@ class GoogleReaderClient(object):
                     (key, value.encode('utf-8')) 
                     for key, value in post_data.iteritems() ]
             true_data = urllib.urlencode(true_data)
-            method = urlfetch.POST
+            method = POST
         else:
             true_data = None
-            method = urlfetch.GET
-        request = urllib2.Request(url.encode('utf-8'), true_data, header)
+            method = GET
 
         if log.isEnabledFor("info"):
             if post_data:
                 log.info("Calling %s with parameters:\n    %s" % (
-                        request.get_full_url(), str(post_data)[:TRIM_LOG_MESSAGES_AT]))
+                        url, str(post_data)[:TRIM_LOG_MESSAGES_AT]))
             else:
-                log.info("Calling %s" % request.get_full_url())
+                log.info("Calling %s" % url)
 
-        result = yield ndb.get_context().urlfetch(url.encode('utf-8'), payload=request.data, method=method, headers=request.headers)
+        result = yield self.transport.fetch(url, payload=true_data, method=method, headers=header, deadline=timeout, retry_safe=retry_safe)
+        self.stats.incr('calls')
+        self.stats.incr('bytes_wire', result.wire_length)
+        self.stats.incr('bytes_content', len(result.content))
 
         log.debug("Result: %s" % result.content[:TRIM_LOG_MESSAGES_AT])
 
-        raise ndb.Return(result.content)
+        raise ndb.Return(result)
 
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Retry policy (exponential backoff with jitter, bounded by an overall
+deadline), circuit breakers and operation deadlines, used by
+GoogleReaderClient to survive transient Google failures and to fail fast
+when some endpoint is down or the time budget is spent.
+"""
+
+import random
+import time
+
+class RetryPolicy(object):
+    """
+    max_attempts - how many times the call is tried at all (1 = no retries)
+    initial_delay - sleep before the first retry (seconds)
+    multiplier - growth factor of subsequent sleeps
+    max_delay - upper bound of a single sleep
+    jitter - fraction of the sleep which is randomized (0 - none, 1 - full)
+    deadline - no retry is started if it could not begin before this many
+        seconds since the first attempt
+    """
+
+    def __init__(self, max_attempts=3, initial_delay=0.2, multiplier=2.0,
+                 max_delay=5.0, jitter=0.5, deadline=30.0):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+
+    def backoff(self, attempts, elapsed):
+        """
+        Returns how long to sleep before the next attempt, or None if the
+        call should not be retried. attempts is the number of attempts
+        made so far, elapsed the time spent since the first one.
+        """
+        if attempts >= self.max_attempts:
+            return None
+        delay = min(self.max_delay,
+                    self.initial_delay * self.multiplier ** (attempts - 1))
+        delay *= 1 - self.jitter * random.random()
+        if self.deadline is not None and elapsed + delay > self.deadline:
+            return None
+        return delay
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+class Deadline(object):
+    """
+    Time budget of an operation: the moment (by clock) it must be
+    finished by. Created from the number of seconds left.
+    """
+
+    def __init__(self, seconds, clock=time.time):
+        self.clock = clock
+        self.expires = clock() + seconds
+
+    @classmethod
+    def coerce(cls, value):
+        """
+        Accepts None (no deadline), number of seconds or Deadline.
+        """
+        if value is None or isinstance(value, Deadline):
+            return value
+        return cls(value)
+
+    def remaining(self):
+        return max(0.0, self.expires - self.clock())
+
+    @property
+    def expired(self):
+        return self.clock() >= self.expires
+
+    def split(self, share):
+        """
+        Deadline for a sub-call which may use only given share of the
+        remaining time, leaving the rest for the calls which follow.
+        """
+        return Deadline(self.remaining() * share, self.clock)
+
+class CircuitBreaker(object):
+    """
+    Opens after failure_threshold consecutive failures. While open, calls
+    are refused, except for one trial call per reset_timeout seconds.
+    Success of any call closes the breaker again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        now = self.clock()
+        if now - self.opened_at >= self.reset_timeout:
+            # Let one trial call through, others wait another period
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+class CircuitBreakers(object):
+    """
+    One CircuitBreaker per endpoint family, created on first use with
+    the given settings.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._breakers = {}
+
+    def get(self, family):
+        breaker = self._breakers.get(family)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold,
+                                     self.reset_timeout, self.clock)
+            self._breakers[family] = breaker
+        return breaker
+
+    def snapshot(self):
+        return dict((family, breaker.state)
+                    for family, breaker in self._breakers.items())
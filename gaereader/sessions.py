@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""
+Session stores, letting new GoogleReaderClient instances (in other
+requests or on other instances) reuse the login session instead of
+calling ClientLogin again.
+
+Session is a dictionary with keys session_id, my_id, token and
+token_time, stored by login. Note that it grants access to the account,
+so keep the stores private.
+"""
+
+from google.appengine.ext import ndb
+
+class SessionStore(object):
+    """
+    Base class of stores. All methods are tasklets.
+    """
+
+    def get(self, login):
+        raise NotImplementedError
+
+    def put(self, login, session):
+        raise NotImplementedError
+
+    def delete(self, login):
+        raise NotImplementedError
+
+class MemorySessionStore(SessionStore):
+    """
+    Keeps sessions in the process memory (module level instance may be
+    shared by all clients of the instance).
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    @ndb.tasklet
+    def get(self, login):
+        session = self._sessions.get(login)
+        raise ndb.Return(session and dict(session))
+
+    @ndb.tasklet
+    def put(self, login, session):
+        self._sessions[login] = dict(session)
+
+    @ndb.tasklet
+    def delete(self, login):
+        self._sessions.pop(login, None)
+
+class MemcacheSessionStore(SessionStore):
+    """
+    Keeps sessions in memcache for expiry seconds.
+    """
+
+    KEY_PREFIX = 'gaereader:session:'
+
+    def __init__(self, expiry=24 * 60 * 60, namespace=None):
+        self.expiry = expiry
+        self.namespace = namespace
+
+    def _key(self, login):
+        return self.KEY_PREFIX + login.encode('utf-8')
+
+    @ndb.tasklet
+    def get(self, login):
+        session = yield ndb.get_context().memcache_get(
+            self._key(login), namespace=self.namespace)
+        raise ndb.Return(session)
+
+    @ndb.tasklet
+    def put(self, login, session):
+        yield ndb.get_context().memcache_set(
+            self._key(login), session, time=self.expiry,
+            namespace=self.namespace)
+
+    @ndb.tasklet
+    def delete(self, login):
+        yield ndb.get_context().memcache_delete(
+            self._key(login), namespace=self.namespace)
+
+class ReaderSession(ndb.Model):
+    """
+    Datastore entity of NdbSessionStore, keyed by login.
+    """
+    session_id = ndb.StringProperty(indexed=False)
+    my_id = ndb.StringProperty(indexed=False)
+    token = ndb.StringProperty(indexed=False)
+    token_time = ndb.FloatProperty(indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+class NdbSessionStore(SessionStore):
+    """
+    Keeps sessions in the datastore (ReaderSession entities). ndb's own
+    caching makes repeated reads cheap.
+    """
+
+    FIELDS = ('session_id', 'my_id', 'token', 'token_time')
+
+    @ndb.tasklet
+    def get(self, login):
+        entity = yield ReaderSession.get_by_id_async(login)
+        if entity is None:
+            raise ndb.Return(None)
+        raise ndb.Return(dict((name, getattr(entity, name))
+                              for name in self.FIELDS))
+
+    @ndb.tasklet
+    def put(self, login, session):
+        entity = ReaderSession(id=login, **dict(
+            (name, session.get(name)) for name in self.FIELDS))
+        yield entity.put_async()
+
+    @ndb.tasklet
+    def delete(self, login):
+        yield ndb.Key(ReaderSession, login).delete_async()
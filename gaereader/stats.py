@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+"""
+Counters collected by GoogleReaderClient (see GoogleReaderClient.get_stats).
+"""
+
+from collections import defaultdict
+
+class ClientStats(object):
+    """
+    Named counters. snapshot() returns plain dictionary copy.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+
+    def incr(self, name, value=1):
+        self.counters[name] += value
+
+    def snapshot(self):
+        return dict(self.counters)
+
+    def reset(self):
+        self.counters.clear()
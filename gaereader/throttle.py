@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throttling of Google Reader calls.
+
+RateLimiter keeps a local token bucket per endpoint family and,
+optionally, a global per account budget shared by all App Engine
+instances through memcache.
+
+AdaptiveConcurrencyLimiter caps the number of outstanding calls,
+adjusting the cap to how Google copes with the load (AIMD).
+
+Both may be shared by tasklets of many threads (every thread runs its
+own ndb event loop). Waiting callers are queued per key (account) and
+served by the keys in turn.
+"""
+
+import collections
+import threading
+import time
+
+from google.appengine.ext import ndb
+from google.appengine.ext.ndb import eventloop
+
+import logging
+log = logging.getLogger("reader")
+
+class _Waiter(object):
+    """
+    Caller waiting in _FairQueue. granted is set (under the owner's
+    lock) by whichever thread serves it, future is set only on the event
+    loop of the thread which created it.
+    """
+
+    __slots__ = ('loop', 'future', 'count', 'granted')
+
+    def __init__(self, count=1):
+        self.loop = eventloop.get_event_loop()
+        self.future = ndb.Future('throttle wait')
+        self.count = count
+        self.granted = False
+
+class _FairQueue(object):
+    """
+    Waiters queued per key, the keys being served in turn, so that one
+    key queueing many calls does not starve the others. Not locked by
+    itself, the owner guards it.
+    """
+
+    def __init__(self):
+        # key -> deque of waiters, keys in the order of service
+        self._queues = collections.OrderedDict()
+
+    def __nonzero__(self):
+        return bool(self._queues)
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def push(self, key, count=1):
+        waiter = _Waiter(count)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+        queue.append(waiter)
+        return waiter
+
+    def peek(self):
+        return next(self._queues.itervalues())[0]
+
+    def pop(self):
+        key, queue = self._queues.popitem(last=False)
+        waiter = queue.popleft()
+        if queue:
+            # Next waiter of this key goes behind the other keys
+            self._queues[key] = queue
+        return waiter
+
+class TokenBucket(object):
+    """
+    Classic token bucket: rate tokens per second, at most capacity
+    of them saved for bursts. Waiting callers are served by keys in
+    turn (first come, first served within a key).
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.time):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+        self._waiters = _FairQueue()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, count=1):
+        """
+        Takes count tokens (possibly going into debt), returns how many
+        seconds the caller has to wait before using them. Bypasses the
+        callers waiting in acquire.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= count
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def _serve(self):
+        # Hands the tokens to the waiters, returns seconds to the next
+        # token a waiter needs (None if none waits)
+        self._refill()
+        while self._waiters:
+            count = self._waiters.peek().count
+            # Larger counts than the capacity go into debt
+            needed = min(count, self.capacity)
+            if self.tokens < needed:
+                return (needed - self.tokens) / self.rate
+            self.tokens -= count
+            self._waiters.pop().granted = True
+        return None
+
+    @ndb.tasklet
+    def acquire(self, count=1, key=None):
+        """
+        Waits until count tokens are taken on behalf of key.
+        """
+        with self._lock:
+            self._refill()
+            if not self._waiters and self.tokens >= count:
+                self.tokens -= count
+                return
+            waiter = self._waiters.push(key, count)
+        while True:
+            # Every waiter serves the queue when it wakes up, so tokens
+            # reach the waiters of other threads too
+            with self._lock:
+                wait = self._serve()
+                if waiter.granted:
+                    return
+            yield ndb.sleep(wait)
+
+class MemcacheRateLimit(object):
+    """
+    Global limit of rate calls per second, shared through memcache by all
+    instances (fixed one second windows). If memcache is unavailable,
+    calls are not limited.
+    """
+
+    KEY_PREFIX = 'gaereader:rate:'
+
+    def __init__(self, rate, window=1.0, clock=time.time):
+        self.limit = max(1, int(rate * window))
+        self.window = window
+        self.clock = clock
+
+    @ndb.tasklet
+    def acquire(self, key):
+        ctx = ndb.get_context()
+        while True:
+            now = self.clock()
+            slot = int(now // self.window)
+            memcache_key = '%s%s:%d' % (self.KEY_PREFIX, key, slot)
+            count = yield ctx.memcache_incr(memcache_key)
+            if count is None:
+                yield ctx.memcache_add(memcache_key, 0, time=int(self.window * 2) + 1)
+                count = yield ctx.memcache_incr(memcache_key)
+                if count is None:
+                    log.warning("Memcache unavailable, %s not limited" % key)
+                    return
+            if count <= self.limit:
+                return
+            yield ndb.sleep((slot + 1) * self.window - now)
+
+class RateLimiter(object):
+    """
+    Rate limits per endpoint family (see reader_client.endpoint_family).
+    Accounts waiting for the same family's bucket get its tokens in turn.
+
+    limits - dictionary family -> (rate, burst) of local (per client)
+        token buckets. Key 'default' applies to families not listed.
+        Families without limit are not throttled.
+    global_limits - dictionary family -> rate of per account limits
+        shared by all instances through memcache ('default' works as above).
+
+    By default nothing is limited. Example giving writes their own budget:
+
+        RateLimiter(limits={'edit': (2, 5), 'default': (20, 40)},
+                    global_limits={'edit': 5})
+    """
+
+    def __init__(self, limits=None, global_limits=None):
+        self.limits = dict(limits or {})
+        self.global_limits = dict(global_limits or {})
+        self._buckets = {}
+        self._global = {}
+
+    def _bucket(self, family):
+        bucket = self._buckets.get(family)
+        if bucket is None:
+            limit = self.limits.get(family, self.limits.get('default'))
+            if limit is None:
+                return None
+            rate, burst = limit
+            # setdefault keeps one bucket when threads race here
+            bucket = self._buckets.setdefault(family, TokenBucket(rate, burst))
+        return bucket
+
+    def _global_limit(self, family):
+        limit = self._global.get(family)
+        if limit is None:
+            rate = self.global_limits.get(family, self.global_limits.get('default'))
+            if rate is None:
+                return None
+            limit = self._global.setdefault(family, MemcacheRateLimit(rate))
+        return limit
+
+    @ndb.tasklet
+    def acquire(self, family, account=None):
+        """
+        Waits until a call of the given family may be made on behalf
+        of account.
+        """
+        bucket = self._bucket(family)
+        if bucket is not None:
+            yield bucket.acquire(key=account)
+        limit = self._global_limit(family)
+        if limit is not None:
+            yield limit.acquire('%s:%s' % (account, family))
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Caps the number of calls in flight. The cap grows additively (by one
+    per cap's worth of calls) while calls finish within latency_target,
+    and is multiplied by backoff when a call signals overload (timeout,
+    429 or 503 reply) - once per round trip, as calls started before the
+    last decrease do not decrease the cap again.
+
+    Waiting callers may name the key (account) they wait for. Freed slots
+    are handed to the keys in turn, so that one account queueing many
+    calls does not starve the others sharing the limiter.
+
+    The limiter may be shared by threads. A slot freed by the waiter's
+    own thread wakes it at once, one freed by another thread is noticed
+    within poll_interval seconds (ndb futures can be resolved only on
+    their own thread's event loop).
+
+    Usage:
+
+        started = yield limiter.acquire(key)
+        try:
+            ... make the call ...
+        finally:
+            limiter.release(started, overloaded)
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64, latency_target=5.0,
+                 backoff=0.5, poll_interval=0.05, clock=time.time):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        self._waiters = _FairQueue()
+
+    @ndb.tasklet
+    def acquire(self, key=None):
+        """
+        Waits for a free slot, returns the start time to be passed
+        to release.
+        """
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                waiter = None
+            else:
+                waiter = self._waiters.push(key)
+        if waiter is not None:
+            self._poll(waiter)
+            yield waiter.future
+        raise ndb.Return(self.clock())
+
+    def _poll(self, waiter):
+        # Runs on the waiter's event loop, keeping it busy (so that it
+        # does not end up deadlocked) until the slot is granted
+        if waiter.future.done():
+            return
+        if waiter.granted:
+            waiter.future.set_result(None)
+        else:
+            eventloop.queue_call(self.poll_interval, self._poll, waiter)
+
+    def release(self, started, overloaded=False):
+        with self._lock:
+            now = self.clock()
+            if overloaded:
+                if self._last_decrease is None or started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif now - started <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.in_flight -= 1
+            woken = self._wake()
+        self._resolve(woken)
+
+    def cancel(self):
+        """
+        Gives up the acquired slot without making the call (the cap
+        is not adjusted).
+        """
+        with self._lock:
+            self.in_flight -= 1
+            woken = self._wake()
+        self._resolve(woken)
+
+    def _wake(self):
+        # Grants the free slots, under the lock
+        woken = []
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.pop()
+            self.in_flight += 1
+            waiter.granted = True
+            woken.append(waiter)
+        return woken
+
+    def _resolve(self, woken):
+        # Waiters of other threads learn about their slots in _poll
+        loop = eventloop.get_event_loop()
+        for waiter in woken:
+            if waiter.loop is loop and not waiter.future.done():
+                waiter.future.set_result(None)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'waiting': len(self._waiters),
+                'decreases': self.decreases,
+                }
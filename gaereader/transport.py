@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+"""
+HTTP transports used by GoogleReaderClient.
+
+Every request the client makes goes through a transport object, which
+only has to implement the fetch tasklet.  Two backends are provided:
+
+- UrlfetchTransport (default) - App Engine urlfetch through the ndb
+  context, so calls are asynchronous RPCs,
+- PooledTransport - persistent keep-alive httplib connections, for
+  running the client outside App Engine (batch workers, cron boxes).
+"""
+
+import errno
+import httplib
+import socket
+import threading
+import urlparse
+import zlib
+
+from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
+
+GET = 'GET'
+POST = 'POST'
+
+# Longest deadline urlfetch accepts for online requests
+MAX_DEADLINE = 60
+
+# Value of Accept-Encoding sent by the client, and the size of chunks
+# fed to the decompressor
+ACCEPT_ENCODING = 'gzip, deflate'
+CHUNK_SIZE = 64 * 1024
+
+# Failures worth retrying: transport exceptions and reply statuses
+TRANSIENT_ERRORS = (urlfetch.DownloadError, socket.error, httplib.HTTPException)
+TRANSIENT_STATUS = frozenset([429, 500, 502, 503, 504])
+
+# Failures signalling that Google is overloaded
+TIMEOUT_ERRORS = (urlfetch.DeadlineExceededError, socket.timeout)
+OVERLOAD_STATUS = frozenset([429, 503])
+
+class Response(object):
+    """
+    Transport independent reply: status_code, content (decompressed),
+    headers (dictionary with lowercased names), final_url and wire_length
+    (size of the body as transferred, before decompression).
+    """
+
+    __slots__ = ('status_code', 'content', 'headers', 'final_url',
+                 'wire_length')
+
+    def __init__(self, status_code, content, headers=None, final_url=None,
+                 wire_length=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.final_url = final_url
+        if wire_length is None:
+            wire_length = len(content)
+        self.wire_length = wire_length
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+def _lower_headers(headers):
+    if not headers:
+        return {}
+    return dict((key.lower(), value) for key, value in headers.items())
+
+class Decoder(object):
+    """
+    Incremental decoder of gzip/deflate Content-Encoding. Unknown or
+    missing encodings pass the data through.
+    """
+
+    def __init__(self, encoding):
+        encoding = (encoding or '').strip().lower()
+        self.encoding = encoding
+        self.wire_length = 0
+        self._first = True
+        if encoding in ('gzip', 'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._obj = zlib.decompressobj()
+        else:
+            self._obj = None
+
+    @property
+    def decompressing(self):
+        return self._obj is not None
+
+    def feed(self, data):
+        self.wire_length += len(data)
+        if self._obj is None:
+            return data
+        try:
+            result = self._obj.decompress(data)
+        except zlib.error:
+            if not (self._first and self.encoding == 'deflate'):
+                raise
+            # Some servers send raw deflate stream without zlib header
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            result = self._obj.decompress(data)
+        self._first = False
+        return result
+
+    def flush(self):
+        if self._obj is None:
+            return ''
+        return self._obj.flush()
+
+def decode_response(status_code, chunks, headers, final_url):
+    """
+    Builds Response out of the (possibly compressed) body chunks.
+    """
+    decoder = Decoder(headers.get('content-encoding'))
+    parts = [decoder.feed(chunk) for chunk in chunks]
+    parts.append(decoder.flush())
+    if decoder.decompressing:
+        headers = dict(headers)
+        del headers['content-encoding']
+    return Response(status_code, ''.join(parts), headers, final_url,
+                    decoder.wire_length)
+
+def _chunked(content):
+    for start in xrange(0, len(content), CHUNK_SIZE):
+        yield content[start:start + CHUNK_SIZE]
+
+class Transport(object):
+    """
+    Base class of transports. fetch must be a tasklet returning Response.
+    retry_safe tells whether a POST may be sent again if the transport
+    believes it was not delivered (GETs always may).
+    """
+
+    def fetch(self, url, payload=None, method=GET, headers=None, deadline=None,
+              retry_safe=False):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class UrlfetchTransport(Transport):
+    """
+    App Engine urlfetch (via ndb.Context.urlfetch, so calls are batched
+    into the ndb event loop).
+    """
+
+    METHODS = {GET: urlfetch.GET, POST: urlfetch.POST}
+
+    @ndb.tasklet
+    def fetch(self, url, payload=None, method=GET, headers=None, deadline=None,
+              retry_safe=False):
+        kwargs = {}
+        if deadline is not None:
+            kwargs['deadline'] = min(deadline, MAX_DEADLINE)
+        result = yield ndb.get_context().urlfetch(
+            url, payload=payload, method=self.METHODS[method],
+            headers=headers or {}, **kwargs)
+        raise ndb.Return(decode_response(
+            result.status_code, _chunked(result.content),
+            _lower_headers(getattr(result, 'headers', None)),
+            getattr(result, 'final_url', None) or url))
+
+class PooledTransport(Transport):
+    """
+    Keeps keep-alive connections open per (scheme, host, port), so that
+    subsequent calls skip the TCP and TLS handshakes.
+
+    Calls are blocking (the tasklet completes synchronously), so this
+    backend is meant for use outside App Engine. It is thread safe,
+    every thread gets its own connection out of the pool.
+
+    max_per_host - how many idle connections are kept for one host
+    timeout - socket timeout used when the call has no deadline
+    """
+
+    MAX_REDIRECTS = 5
+
+    # Send errors meaning that the server closed the idle connection
+    STALE_ERRNOS = frozenset([errno.ECONNRESET, errno.EPIPE])
+
+    def __init__(self, max_per_host=4, timeout=MAX_DEADLINE):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _checkout(self, key, fresh=False):
+        if not fresh:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop(), True
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _set_timeout(self, conn, timeout):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _send_reused(self, conn, method, path, payload, headers):
+        """
+        Sends the request and reads the reply status. Returns None if
+        the connection turned out to be closed by the server before it
+        replied anything (so the request was not processed), otherwise
+        the reply.
+        """
+        try:
+            conn.request(method, path, payload, headers)
+        except socket.timeout:
+            raise
+        except socket.error, e:
+            if e.errno in self.STALE_ERRNOS:
+                return None
+            raise
+        try:
+            return conn.getresponse()
+        except httplib.BadStatusLine:
+            return None
+
+    def _request(self, url, payload, method, headers, deadline, retry_safe):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (scheme == 'https' and 443 or 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        if payload is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+        timeout = self.timeout if deadline is None else deadline
+        conn, reused = self._checkout(key)
+        try:
+            self._set_timeout(conn, timeout)
+            if reused and (method == GET or retry_safe):
+                reply = self._send_reused(conn, method, path, payload, headers)
+                if reply is None:
+                    # The server closed the idle keep-alive connection,
+                    # retry once on a fresh one
+                    conn.close()
+                    conn, reused = self._checkout(key, fresh=True)
+                    self._set_timeout(conn, timeout)
+                    conn.request(method, path, payload, headers)
+                    reply = conn.getresponse()
+            else:
+                conn.request(method, path, payload, headers)
+                reply = conn.getresponse()
+            response = decode_response(
+                reply.status, iter(lambda: reply.read(CHUNK_SIZE), ''),
+                _lower_headers(dict(reply.getheaders())), url)
+        except Exception:
+            conn.close()
+            raise
+        if reply.will_close:
+            conn.close()
+        else:
+            # The deadline was for this call only
+            self._set_timeout(conn, self.timeout)
+            self._checkin(key, conn)
+        return response
+
+    @ndb.tasklet
+    def fetch(self, url, payload=None, method=GET, headers=None, deadline=None,
+              retry_safe=False):
+        for _ in xrange(self.MAX_REDIRECTS + 1):
+            response = self._request(url, payload, method, headers, deadline,
+                                     retry_safe)
+            location = response.header('location')
+            if method != GET or response.status_code not in (301, 302, 303, 307) \
+                    or not location:
+                break
+            url = urlparse.urljoin(url, location)
+        raise ndb.Return(response)
@@ -115,6 +115,5 @@ for attempt in ['http://sport.pl', 'http://sport.interia.pl']:
 
 if feeds_to_clean:
     title("Unsubscribing just subscribed")
-    for feed in feeds_to_clean:
-        print "  ", feed
-        reader_client.unsubscribe_feed(feed)
+    for result in reader_client.unsubscribe_many(feeds_to_clean).get_result():
+        print "  ", result.feed_url, result.error or "OK"
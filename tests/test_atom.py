@@ -0,0 +1,188 @@
+import collections
+
+import pytest
+
+import gaereader
+from gaereader import atom
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+PAGE = """<?xml version="1.0"?>
+<feed xmlns:gr="http://www.google.com/schemas/reader/atom/" xmlns="http://www.w3.org/2005/Atom" gr:dir="ltr">
+<id>tag:google.com,2005:reader/feed/http://example.com/feed</id>
+<title>Example</title>
+<gr:continuation>CONT</gr:continuation>
+<link rel="alternate" href="http://example.com/" type="text/html"/>
+<updated>2011-05-01T10:00:00Z</updated>
+<entry gr:crawl-timestamp-msec="1304244000000">
+<id gr:original-id="http://example.com/1">tag:google.com,2005:reader/item/00000000000000a1</id>
+<category term="user/123/state/com.google/read" scheme="http://www.google.com/reader/" label="read"/>
+<title type="html">First</title>
+<published>2011-05-01T09:00:00Z</published>
+<updated>2011-05-01T09:30:00Z</updated>
+<link rel="alternate" href="http://example.com/1" type="text/html"/>
+<author><name>Alice</name></author>
+</entry>
+<entry gr:crawl-timestamp-msec="1304244000001">
+<id gr:original-id="http://example.com/2">tag:google.com,2005:reader/item/00000000000000a2</id>
+<title type="html">Second</title>
+<published>2011-05-01T08:00:00Z</published>
+<updated>2011-05-01T08:00:00Z</updated>
+<link rel="alternate" href="http://example.com/2" type="text/html"/>
+<link rel="enclosure" href="http://example.com/2.mp3" type="audio/mpeg"/>
+<author><name>Bob</name></author>
+</entry>
+</feed>
+"""
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+
+@ndb.tasklet
+def mock_urlfetch(self, url, **_kwargv):
+  calls[url] += 1
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url.startswith("http://www.google.com/reader/atom/feed/"):
+    result = PAGE
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_AtomStream():
+  stream = atom.AtomStream(PAGE)
+  assert stream.continuation == "CONT"
+  assert stream.feed["title"] == "Example"
+  assert stream.feed["links"] == [{"rel": "alternate", "href": "http://example.com/", "type": "text/html"}]
+
+  ids = []
+  previous = None
+  for entry in stream:
+    if previous is not None:
+      # consumed entries are freed
+      assert len(previous) == 0 and previous.getparent() is None
+    ids.append(entry.findtext("{http://www.w3.org/2005/Atom}id"))
+    previous = entry
+  assert ids == ["tag:google.com,2005:reader/item/00000000000000a1",
+                 "tag:google.com,2005:reader/item/00000000000000a2"]
+  assert list(stream) == []
+
+def test_stream_format(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+
+  @ndb.synctasklet
+  def fan_out():
+    streams = yield [c.get_feed_atom("http://example.com/feed", format="stream")
+                     for i in range(3)]
+    raise ndb.Return(streams)
+
+  streams = fan_out()
+  assert len(set(id(s) for s in streams)) == 3
+  assert [len(list(s)) for s in streams] == [2, 2, 2]
+  assert calls["http://www.google.com/reader/atom/feed/http%3A%2F%2Fexample.com%2Ffeed"] == 1
+
+def test_AtomPage():
+  page = atom.AtomPage.parse(PAGE)
+  assert page.continuation == "CONT"
+  assert len(page) == 2
+  first, second = page
+  assert first.id == "tag:google.com,2005:reader/item/00000000000000a1"
+  assert first.title == "First"
+  assert first.link == "http://example.com/1"
+  assert first.author == "Alice"
+  assert first.published == "2011-05-01T09:00:00Z"
+  assert first.updated == "2011-05-01T09:30:00Z"
+  assert second.links == (("alternate", "http://example.com/2"),
+                          ("enclosure", "http://example.com/2.mp3"))
+  # repeated values are shared
+  assert second.links[0][0] is first.links[0][0]
+  assert second.published is second.updated
+  assert not hasattr(first, "__dict__")
+
+def test_records_format(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  page = c.get_feed_atom("http://example.com/feed", format="records").get_result()
+  assert isinstance(page, gaereader.AtomPage)
+  assert [e.title for e in page] == ["First", "Second"]
+
+def test_extract_entries():
+  from lxml import etree, objectify
+  for tree in (etree.XML(PAGE), objectify.fromstring(PAGE)):
+    columns = gaereader.extract_entries(tree, fields=("id", "link", "author", "crawled", "categories", "summary"))
+    assert columns["id"] == ["tag:google.com,2005:reader/item/00000000000000a1",
+                             "tag:google.com,2005:reader/item/00000000000000a2"]
+    assert columns["link"] == ["http://example.com/1", "http://example.com/2"]
+    assert columns["author"] == ["Alice", "Bob"]
+    assert columns["crawled"] == ["1304244000000", "1304244000001"]
+    assert columns["categories"] == [["user/123/state/com.google/read"], []]
+    assert columns["summary"] == [None, None]
+  with pytest.raises(ValueError):
+    gaereader.extract_entries(etree.XML(PAGE), fields=("nonsense",))
+
+def test_extract_entries_uneven():
+  from lxml import etree, objectify
+  page = """<feed xmlns="http://www.w3.org/2005/Atom">
+<entry><title>Plain</title><content>one</content></entry>
+<entry><content type="xhtml">two <b>bold</b> words</content></entry>
+<entry><title></title></entry>
+</feed>"""
+  for tree in (etree.XML(page), objectify.fromstring(page)):
+    columns = gaereader.extract_entries(tree, fields=("title", "content", "id"))
+    assert columns["title"] == ["Plain", None, None]
+    assert columns["content"] == ["one", "two bold words", None]
+    assert columns["id"] == [None, None, None]
+  assert gaereader.extract_entries(etree.XML(page.replace("entry", "x"))) == \
+      dict((field, []) for field in atom.DEFAULT_FIELDS)
+
+def test_parsers_per_thread():
+  import threading
+  parser = atom.get_parser("etree")
+  assert atom.get_parser("etree") is parser
+  assert atom.get_parser("etree", huge_tree=True) is not parser
+  other = []
+  thread = threading.Thread(target=lambda: other.append(atom.get_parser("etree")))
+  thread.start()
+  thread.join()
+  assert other[0] is not parser
+
+def test_parser_hardened():
+  from lxml import etree
+  doc = """<?xml version="1.0"?>
+<!DOCTYPE feed [<!ENTITY secret SYSTEM "file:///etc/passwd">]>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>&secret;</title>
+  <entry/>
+</feed>"""
+  tree = etree.XML(doc, atom.get_parser("etree"))
+  assert "root:" not in etree.tostring(tree)
+  assert tree[0].tail is None
+
+def test_parse_stats(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  c.get_feed_atom("http://example.com/feed", format="etree").get_result()
+  stats = c.get_stats()
+  assert stats["pages_parsed"] == 1
+  assert stats["parse_seconds"] >= 0
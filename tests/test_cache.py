@@ -0,0 +1,82 @@
+import collections
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+
+@ndb.tasklet
+def mock_urlfetch(self, url, headers=None, **_kwargv):
+  calls[url] += 1
+  response_headers = {}
+  status_code = 200
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url == "http://www.google.com/reader/api/0/subscription/list?output=json":
+    if headers.get("If-None-Match") == '"v1"':
+      result = ""
+      status_code = 304
+    else:
+      result = '{"subscriptions": []}'
+    response_headers["ETag"] = '"v1"'
+  elif url == "http://www.google.com/reader/atom/feed/url":
+    if headers.get("If-Modified-Since") == "Mon, 01 Apr 2013 00:00:00 GMT":
+      result = ""
+      status_code = 304
+    else:
+      result = '<?xml version="1.0"?><feed><entry><id>id</id></entry></feed>'
+    response_headers["Last-Modified"] = "Mon, 01 Apr 2013 00:00:00 GMT"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = status_code
+  result.url = url
+  result.headers = response_headers
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_conditional_get(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+
+  first = c.get_subscription_list().get_result()
+  second = c.get_subscription_list().get_result()
+  assert first == {"subscriptions": []}
+  assert second is first
+  assert calls["http://www.google.com/reader/api/0/subscription/list?output=json"] == 2
+
+  first = c.get_feed_atom("url").get_result()
+  second = c.get_feed_atom("url").get_result()
+  assert second is first
+  assert c.get_feed_atom("url", format="xml").get_result().startswith("<?xml")
+
+def test_conditional_get_disabled(mock):
+  c = gaereader.GoogleReaderClient("login", "password",
+                                   validator_cache=gaereader.ValidatorCache(0))
+  first = c.get_subscription_list().get_result()
+  second = c.get_subscription_list().get_result()
+  assert second == first
+  assert second is not first
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+def feed_reply(feed, published):
+  return json.dumps({"id": "feed/" + feed, "items": [
+    {"id": "tag:google.com,2005:reader/item/%016x" % (p * 7919),
+     "crawlTimeMsec": str(p * 1000), "published": p,
+     "title": "%s %d" % (feed, p), "origin": {"streamId": "feed/" + feed}}
+    for p in published]})
+
+REPLIES = {
+  "a": feed_reply("a", [100, 300, 500]),
+  "b": feed_reply("b", [200, 400]),
+  "d": json.dumps({"id": "feed/d", "items": [
+    {"id": "tag:google.com,2005:reader/item/00000000000000d1", "published": 600},
+    {"id": "tag:google.com,2005:reader/item/00000000000000d2", "published": 700,
+     "origin": "feed/d"}]}),
+  }
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+@ndb.tasklet
+def mock_urlfetch(self, url, **_kwargv):
+  status_code = 200
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url.startswith("http://www.google.com/reader/api/0/stream/contents/feed/"):
+    feed = url.split("/feed/")[1].split("?")[0]
+    if feed in REPLIES:
+      result = REPLIES[feed]
+    else:
+      status_code = 404
+      result = "Not found"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = status_code
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_ItemColumns():
+  c = gaereader.ItemColumns.from_items(
+    json.loads(REPLIES["a"])["items"] + json.loads(REPLIES["b"])["items"])
+  assert len(c) == 5
+  assert list(c.published) == [100, 300, 500, 200, 400]
+  assert c.streams[0] is c.streams[1]
+  assert list(c.sort().published) == [500, 400, 300, 200, 100]
+  assert list(c.sort(reverse=False).published) == [100, 200, 300, 400, 500]
+  window = c.between(start=200, end=500)
+  assert list(window.published) == [300, 200, 400]
+  assert window.titles == ["a 300", "b 200", "b 400"]
+  top = c.top(2)
+  assert list(top.published) == [500, 400]
+  assert list(top.crawled) == [500000, 400000]
+  assert [row[3] for row in top.rows()] == ["feed/a", "feed/b"]
+  with pytest.raises(ValueError):
+    c.sort(key="titles")
+
+def test_feed_contents_columns(mock):
+  client = gaereader.GoogleReaderClient("login", "password")
+  result, errors = client.feed_contents_columns(["a", "b", "c"]).get_result()
+  assert list(result.top(3).published) == [500, 400, 300]
+  assert errors.keys() == ["c"]
+
+def test_malformed_items(mock):
+  c = gaereader.ItemColumns()
+  c.append({"id": "1", "origin": {"streamId": "feed/a"}})
+  for item in ({"id": "2", "origin": "feed/b"}, {"title": "no id"},
+               {"id": "3", "title": ["unhashable"]}):
+    with pytest.raises(ValueError):
+      c.append(item)
+  assert len(c) == len(c.crawled) == len(c.published) == len(c.streams) == len(c.titles) == 1
+  assert list(c.top(5).ids) == [1]
+
+  client = gaereader.GoogleReaderClient("login", "password")
+  result, errors = client.feed_contents_columns(["a", "d"]).get_result()
+  assert errors.keys() == ["d"]
+  assert isinstance(errors["d"], gaereader.GoogleOperationFailed)
+  # items decoded before the bad one are kept
+  assert list(result.top(2).published) == [600, 500]
@@ -0,0 +1,147 @@
+import collections
+import urlparse
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+edits = []
+
+@ndb.tasklet
+def mock_urlfetch(self, url, payload=None, **_kwargv):
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url == "http://www.google.com/reader/api/0/tag/list?output=json":
+    result = '{"tags": [{"id":"user/0/"}]}'
+  elif url == "http://www.google.com/reader/api/0/token":
+    result = "TOKEN"
+  elif url == "http://www.google.com/reader/api/0/subscription/edit?client=mekk.reader_client":
+    edits.append(urlparse.parse_qsl(payload))
+    result = "OK"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    del edits[:]
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_edits_are_merged(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  buf = c.edit_buffer(max_delay=None)
+
+  assert buf.add_feed_tag("a", "Title A", "one") is None
+  buf.add_feed_tag("feed/a", None, "two")
+  buf.remove_feed_tag("a", None, "user/0/label/one")
+  buf.change_feed_title("a", "New A")
+  buf.subscribe_feed("b", "B")
+  buf.add_feed_tag("b", None, "one")
+  buf.add_feed_tag("c", None, "one")
+  buf.unsubscribe_feed("c")
+  assert len(buf) == 3
+  assert edits == []
+
+  assert buf.flush().get_exception() is None
+  assert len(buf) == 0
+  sent = dict((dict(params)["s"], params) for params in edits)
+  assert len(sent) == 3
+  assert sent["feed/a"] == [("ac", "edit"), ("s", "feed/a"), ("t", "New A"),
+               ("a", "user/0/label/two"), ("r", "user/0/label/one"), ("T", "TOKEN")]
+  assert sent["feed/b"] == [("ac", "subscribe"), ("s", "feed/b"), ("t", "B"),
+               ("a", "user/0/label/one"), ("T", "TOKEN")]
+  assert sent["feed/c"] == [("ac", "unsubscribe"), ("s", "feed/c"), ("T", "TOKEN")]
+
+def test_flush_on_size(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  buf = c.edit_buffer(max_pending=2, max_delay=None)
+  assert buf.unsubscribe_feed("a") is None
+  future = buf.unsubscribe_feed("b")
+  assert future.get_exception() is None
+  assert len(edits) == 2
+
+def test_flush_on_time(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  buf = c.edit_buffer(max_delay=0.01)
+  buf.unsubscribe_feed("a")
+  ndb.eventloop.run()
+  assert len(edits) == 1
+  assert len(buf) == 0
+
+
+@ndb.tasklet
+def mock_urlfetch_bulk(self, url, payload=None, **_kwargv):
+  if url == "http://www.google.com/reader/api/0/subscription/edit?client=mekk.reader_client" \
+     and dict(urlparse.parse_qsl(payload))["s"] == "feed/bad":
+    edits.append(urlparse.parse_qsl(payload))
+    result = Result("")
+    result.status_code = 200
+    result.url = url
+    raise ndb.Return(result)
+  result = yield mock_urlfetch(self, url, payload)
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock_bulk(request):
+
+  def setup():
+    del edits[:]
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch_bulk)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_subscribe_many(mock_bulk):
+  c = gaereader.GoogleReaderClient("login", "password")
+  results = c.subscribe_many(["a", ("b", "B"), ("bad", None, "one"), ("c", "C", ["one", "two"])],
+                             max_concurrency=2).get_result()
+  assert [result.feed_url for result in results] == ["a", "b", "bad", "c"]
+  assert [result.error is None for result in results] == [True, True, False, True]
+  assert isinstance(results[2].error, gaereader.GoogleOperationFailed)
+
+  sent = dict((dict(params)["s"], params) for params in edits)
+  assert sent["feed/c"] == [("ac", "subscribe"), ("s", "feed/c"), ("t", "C"),
+                            ("a", "user/0/label/one"), ("a", "user/0/label/two"), ("T", "TOKEN")]
+
+def test_unsubscribe_many(mock_bulk):
+  c = gaereader.GoogleReaderClient("login", "password")
+  results = c.unsubscribe_many(["feed/%d" % i for i in range(30)]).get_result()
+  assert len(results) == 30
+  assert all(result.error is None for result in results)
+  assert len(edits) == 30
+
+def test_flush_reports_failed_feeds(mock_bulk):
+  c = gaereader.GoogleReaderClient("login", "password")
+  buf = c.edit_buffer(max_delay=None)
+  buf.unsubscribe_feed("good")
+  buf.unsubscribe_feed("bad")
+  results = buf.flush().get_result()
+  assert [r.feed_url for r in results] == ["feed/good", "feed/bad"]
+  assert results[0].error is None
+  assert isinstance(results[1].error, gaereader.GoogleOperationFailed)
+  assert buf.flush().get_result() == []
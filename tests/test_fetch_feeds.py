@@ -0,0 +1,89 @@
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+# feed -> seconds the fetch takes (None: fails)
+DELAYS = {"slow": 0.05, "fast": 0.01, "medium": 0.03, "broken": None}
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+@ndb.tasklet
+def mock_urlfetch(self, url, **_kwargv):
+  status_code = 200
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  else:
+    feed = url.split("/feed/")[1].split("?")[0]
+    delay = DELAYS[feed]
+    if delay is None:
+      status_code = 404
+      result = "Not found"
+    else:
+      yield ndb.sleep(delay)
+      if "/api/0/stream/contents/" in url:
+        result = '{"id": "feed/%s", "items": []}' % feed
+      else:
+        result = '<?xml version="1.0"?><feed><title>%s</title></feed>' % feed
+
+  result = Result(result)
+  result.status_code = status_code
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def collect(queue):
+  results = []
+  while True:
+    try:
+      results.append(queue.getq().get_result())
+    except EOFError:
+      return results
+
+def test_fetch_feeds_as_completed(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  results = collect(c.fetch_feeds(["slow", "fast", "broken", "medium"], format="etree"))
+  assert [r.feed_url for r in results] == ["broken", "fast", "medium", "slow"]
+  assert isinstance(results[0].error, Exception) and results[0].result is None
+  assert results[1].result.findtext("title") == "fast"
+  assert results[1].error is None
+
+def test_fetch_feeds_json(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+
+  @ndb.synctasklet
+  def consume():
+    queue = c.fetch_feeds(["medium", "fast"], format="json", max_concurrency=1)
+    ids = []
+    while True:
+      try:
+        feed = yield queue.getq()
+      except EOFError:
+        break
+      ids.append(feed.result["id"])
+    raise ndb.Return(ids)
+
+  # with one fetch at a time, results come in input order
+  assert consume() == ["feed/medium", "feed/fast"]
+
+def test_fetch_feeds_empty(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  assert collect(c.fetch_feeds([])) == []
@@ -0,0 +1,88 @@
+import collections
+import urlparse
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+edits = []
+
+@ndb.tasklet
+def mock_urlfetch(self, url, payload=None, **_kwargv):
+  calls[url] += 1
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url == "http://www.google.com/reader/api/0/tag/list?output=json":
+    result = '{"tags": [{"id":"user/0/"}]}'
+  elif url == "http://www.google.com/reader/api/0/token":
+    result = "TOKEN"
+  elif url == "http://www.google.com/reader/api/0/edit-tag?client=mekk.reader_client":
+    edits.append(urlparse.parse_qsl(payload))
+    result = "OK"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    del edits[:]
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_mark_read_in_chunks(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  ids = [str(i) for i in range(600)]
+  future = c.mark_read(ids)
+  assert future.get_exception() is None
+
+  assert calls["http://www.google.com/reader/api/0/token"] == 1
+  assert len(edits) == 3
+  sent = []
+  for params in edits:
+    items = [value for key, value in params if key == "i"]
+    assert len(items) <= 250
+    sent.extend(items)
+    assert ("a", "user/-/state/com.google/read") in params
+    assert ("r", "user/-/state/com.google/kept-unread") in params
+    assert ("T", "TOKEN") in params
+  assert sorted(sent) == sorted(ids)
+
+def test_edit_item_tags(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  future = c.edit_item_tags([("1", "feed/a"), ("2", "feed/b")],
+                            add_tags=["tag"], remove_tags=[gaereader.reader_client.STATE_STARRED])
+  assert future.get_exception() is None
+  params = edits[0]
+  assert params[:4] == [("i", "1"), ("s", "feed/a"), ("i", "2"), ("s", "feed/b")]
+  assert ("a", "user/0/label/tag") in params
+  assert ("r", "user/-/state/com.google/starred") in params
+
+def test_star_unstar(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  assert c.star(["1"]).get_exception() is None
+  assert c.unstar(["1"]).get_exception() is None
+  assert ("a", "user/-/state/com.google/starred") in edits[0]
+  assert ("r", "user/-/state/com.google/starred") in edits[1]
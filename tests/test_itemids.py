@@ -0,0 +1,41 @@
+import pytest
+
+import gaereader
+from gaereader import itemids
+
+LONG = "tag:google.com,2005:reader/item/87e5d2ce598bb482"
+SHORT = "-8654279325215116158"
+
+def test_parse_id():
+  assert itemids.parse_id(LONG) == -8654279325215116158
+  assert itemids.parse_id(SHORT) == -8654279325215116158
+  assert itemids.parse_id("tag:google.com,2005:reader/item/5d0cfa30041d4348") == 0x5d0cfa30041d4348
+  assert itemids.parse_id(42) == 42
+
+def test_parse_id_range():
+  assert itemids.parse_id("tag:google.com,2005:reader/item/ffffffffffffffff") == -1
+  assert itemids.parse_id(str(2 ** 63 - 1)) == 2 ** 63 - 1
+  assert itemids.parse_id(str(-2 ** 63)) == -2 ** 63
+  for bad in ["tag:google.com,2005:reader/item/1ffffffffffffffff",
+              "tag:google.com,2005:reader/item/-1",
+              str(2 ** 63), str(-2 ** 63 - 1), 2 ** 64, "abc"]:
+    with pytest.raises(ValueError):
+      itemids.parse_id(bad)
+  with pytest.raises(ValueError):
+    gaereader.parse_ids(["1", "tag:google.com,2005:reader/item/1ffffffffffffffff"])
+
+def test_conversions():
+  assert gaereader.long_ids([SHORT, "7212740130471148824"]) == [
+    LONG, "tag:google.com,2005:reader/item/6418ccef15effd18"]
+  assert gaereader.short_ids([LONG]) == [SHORT]
+  assert gaereader.short_ids(gaereader.long_ids(["0", "-1", "1"])) == ["0", "-1", "1"]
+
+def test_parse_ids_unique():
+  ids = gaereader.parse_ids([LONG, SHORT, "1", 1, "2"], unique=True)
+  assert ids.typecode == itemids.INT64
+  assert list(ids) == [-8654279325215116158, 1, 2]
+  assert len(gaereader.parse_ids([LONG, SHORT])) == 2
+
+def test_normalize_ids():
+  assert gaereader.normalize_ids([LONG, SHORT]) == [LONG]
+  assert gaereader.normalize_ids([LONG, SHORT], form="short", unique=False) == [SHORT, SHORT]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import collections
+import json
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+REPLY = json.dumps(collections.OrderedDict([
+    ("direction", "ltr"),
+    ("id", "feed/http://example.com/feed"),
+    ("title", u"Example ☃"),
+    ("continuation", "CONT"),
+    ("items", [
+      {"id": "tag:google.com,2005:reader/item/00000000000000a1",
+       "title": "First", "published": 1304244000, "summary": {"content": "..."}},
+      {"id": "tag:google.com,2005:reader/item/00000000000000a2",
+       "title": "Second", "published": 1304243000, "categories": ["a", "b"]},
+      ]),
+    ("updated", 1304244001),
+    ]), indent=1)
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+@ndb.tasklet
+def mock_urlfetch(self, url, **_kwargv):
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url.startswith("http://www.google.com/reader/api/0/stream/contents/feed/"):
+    result = REPLY
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_JsonItemStream():
+  stream = gaereader.JsonItemStream(REPLY)
+  assert stream.continuation == "CONT"
+  assert stream.meta["title"] == u"Example ☃"
+  items = list(stream)
+  assert items == json.loads(REPLY)["items"]
+  # values following the items are there once iterated
+  assert stream.meta["updated"] == 1304244001
+  assert list(stream) == []
+
+def test_JsonItemStream_fields():
+  stream = gaereader.JsonItemStream(REPLY, fields=["id", "categories"])
+  assert list(stream) == [
+    {"id": "tag:google.com,2005:reader/item/00000000000000a1"},
+    {"id": "tag:google.com,2005:reader/item/00000000000000a2", "categories": ["a", "b"]}]
+
+def test_JsonItemStream_empty():
+  assert list(gaereader.JsonItemStream('{"items": []}')) == []
+  assert list(gaereader.JsonItemStream('{}')) == []
+  with pytest.raises(ValueError):
+    list(gaereader.JsonItemStream('{"items": [{} {}]}'))
+
+def test_feed_contents_iter_items(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  stream = c.feed_contents("http://example.com/feed", iter_items=True,
+                           fields=["title"]).get_result()
+  assert [item["title"] for item in stream] == ["First", "Second"]
+  reply = c.feed_contents("http://example.com/feed", fields=["title"]).get_result()
+  assert reply["items"] == [{"title": "First"}, {"title": "Second"}]
+  assert reply["continuation"] == "CONT"
+
+def test_iter_contents(monkeypatch):
+  import urlparse
+  requested = []
+
+  @ndb.tasklet
+  def paged_urlfetch(self, url, **_kwargv):
+    if url == "https://www.google.com/accounts/ClientLogin":
+      result = "Auth=DUMMY"
+    else:
+      args = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+      requested.append(args)
+      start, count = int(args.get("c", "0")), int(args["n"])
+      reply = {"items": [{"id": str(i), "published": 1000 + i}
+                         for i in range(start, min(start + count, 5))]}
+      if start + count < 5:
+        reply["continuation"] = str(start + count)
+      result = json.dumps(reply)
+    result = Result(result)
+    result.status_code = 200
+    result.url = url
+    raise ndb.Return(result)
+
+  monkeypatch.setattr(ndb.Context, "urlfetch", paged_urlfetch)
+  c = gaereader.GoogleReaderClient("login", "password")
+  pager = c.iter_contents(feed_url="http://example.com/feed", page_size=2,
+                          start_time=1000, end_time=2000, fields=["id"])
+  assert list(pager) == [{"id": str(i)} for i in range(5)]
+  assert [args.get("c") for args in requested] == [None, "2", "4"]
+  assert all(args["ot"] == "1000" and args["nt"] == "2000" for args in requested)
+
+  del requested[:]
+  reply = c.feed_contents("http://example.com/feed", count=2, continue_from="2").get_result()
+  assert [item["id"] for item in reply["items"]] == ["2", "3"]
+  assert reply["continuation"] == "4"
+  assert "ot" not in requested[0]
+  with pytest.raises(ValueError):
+    c.iter_contents()
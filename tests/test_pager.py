@@ -0,0 +1,129 @@
+import collections
+import urlparse
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+TOTAL = 7
+
+def atom_page(start, count):
+  entries = "".join("<entry><id>item%d</id><title>Item %d</title></entry>" % (i, i)
+                    for i in range(start, min(start + count, TOTAL)))
+  continuation = ""
+  if start + count < TOTAL:
+    continuation = "<gr:continuation>C%d</gr:continuation>" % (start + count)
+  return ('<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom" '
+          'xmlns:gr="http://www.google.com/schemas/reader/atom/">%s%s</feed>'
+          % (continuation, entries))
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+requested = []
+paths = []
+started = []
+
+@ndb.tasklet
+def mock_urlfetch(self, url, **_kwargv):
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url.startswith(("http://www.google.com/reader/atom/user/-/state/com.google/starred",
+                       "http://www.google.com/reader/atom/user/-/label/News",
+                       "http://www.google.com/reader/atom/feed/")):
+    started.append(url)
+    yield ndb.sleep(0.01)
+    args = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+    start = int(args.get("c", "C0")[1:])
+    requested.append((start, int(args["n"])))
+    paths.append(urlparse.urlparse(url).path)
+    result = atom_page(start, int(args["n"]))
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.headers = {"ETag": '"v1"'}
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    del requested[:]
+    del paths[:]
+    del started[:]
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_iter_atom(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  titles = [entry.title for entry in c.iter_atom("starred", page_size=3)]
+  assert titles == ["Item %d" % i for i in range(TOTAL)]
+  assert requested == [(0, 3), (3, 3), (6, 3)]
+
+def test_iter_atom_max_items(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  pager = c.iter_atom("starred", page_size=3, max_items=5, format="etree")
+  ids = [entry.findtext("{http://www.w3.org/2005/Atom}id") for entry in pager]
+  assert ids == ["item%d" % i for i in range(5)]
+  assert requested == [(0, 3), (3, 2)]
+  assert pager.continuation == "C5"
+
+def test_iter_atom_prefetch(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+
+  @ndb.synctasklet
+  def consume():
+    pager = c.iter_atom("starred", page_size=3)
+    pages = []
+    while True:
+      entries = yield pager.next_page()
+      if entries is None:
+        break
+      # while this page is processed, the next one is already fetched
+      yield ndb.sleep(0.05)
+      pages.append(len(entries))
+      if pager.continuation:
+        assert len(requested) == len(pages) + 1
+    raise ndb.Return(pages)
+
+  assert consume() == [3, 3, 1]
+
+def test_iter_atom_prefetch_sync(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  sent = []
+  for entry in c.iter_atom("starred", page_size=3):
+    # plain loop, nothing runs the event loop while the entry is processed
+    sent.append(len(started))
+  assert sent == [2, 2, 2, 3, 3, 3, 3]
+
+def test_continuation_pages_not_cached(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  assert len(list(c.iter_atom("starred", page_size=3))) == TOTAL
+  # only the first page (no continuation) is kept
+  assert len(c.validator_cache) == 1
+
+def test_iter_atom_sources(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  for source in ["starred", "user/-/state/com.google/starred", "user/-/label/News",
+                 "feed/http://example.com/rss", "http://example.com/rss"]:
+    list(c.iter_atom(source, max_items=1))
+  assert paths == ["/reader/atom/user/-/state/com.google/starred",
+                   "/reader/atom/user/-/state/com.google/starred",
+                   "/reader/atom/user/-/label/News",
+                   "/reader/atom/feed/http%3A%2F%2Fexample.com%2Frss",
+                   "/reader/atom/feed/http%3A%2F%2Fexample.com%2Frss"]
@@ -0,0 +1,101 @@
+import collections
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+
+@ndb.tasklet
+def mock_urlfetch(self, url, payload=None, **_kwargv):
+  calls[url] += 1
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=SESSION%d" % calls[url]
+  elif url == "http://www.google.com/reader/api/0/token":
+    result = "TOKEN%d" % calls[url]
+  elif url == "http://www.google.com/reader/api/0/tag/list?output=json":
+    yield ndb.sleep(0.1)
+    result = '{"tags": [{"id": "user/1/label/News"}]}'
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.headers = {}
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+LOGIN_URL = "https://www.google.com/accounts/ClientLogin"
+
+def test_pool_shares_limiters(mock):
+  pool = gaereader.ReaderClientPool(max_clients=2)
+  a = pool.get("a", "password")
+  b = pool.get("b", "password")
+  assert a is not b
+  assert a.transport is b.transport is pool.transport
+  assert a.concurrency is b.concurrency is pool.concurrency
+  assert a.rate_limiter is b.rate_limiter
+  assert a.validator_cache is not b.validator_cache
+  # clients log in on first use
+  assert calls[LOGIN_URL] == 0
+  assert a._get_token().get_result() == "TOKEN1"
+  assert calls[LOGIN_URL] == 1
+  assert pool.get("a", "password") is a
+
+def test_pool_lru(mock):
+  pool = gaereader.ReaderClientPool(max_clients=2)
+  a = pool.get("a", "password")
+  pool.get("b", "password")
+  pool.get("a", "password")
+  pool.get("c", "password")
+  assert "a" in pool and "c" in pool and "b" not in pool
+  assert len(pool) == 2
+  assert pool.evictions == 1
+  assert pool.get("a", "password") is a
+  assert pool.get("a", "changed") is not a
+
+def test_pool_threads(mock):
+  import threading
+  pool = gaereader.ReaderClientPool()
+  results = []
+  start = threading.Event()
+
+  def run():
+    start.wait()
+    try:
+      results.append(pool.get("acct", "pw").get_tag_list().get_result())
+    except Exception, e:
+      results.append(e)
+
+  threads = [threading.Thread(target=run) for _ in range(2)]
+  for thread in threads:
+    thread.start()
+  start.set()
+  for thread in threads:
+    thread.join(10)
+  assert not any(thread.is_alive() for thread in threads)
+  assert [r["tags"][0]["id"] for r in results] == ["user/1/label/News"] * 2
+  assert len(pool) == 1
@@ -0,0 +1,180 @@
+import collections
+import urllib2
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+
+@ndb.tasklet
+def mock_urlfetch(self, url, **_kwargv):
+  calls[url] += 1
+  status_code = 200
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url == "http://www.google.com/reader/api/0/subscription/list?output=json":
+    if calls[url] < 3:
+      status_code = 503
+      result = "Service Unavailable"
+    else:
+      result = '{"subscriptions": []}'
+  elif url == "http://www.google.com/reader/api/0/token":
+    result = "TOKEN"
+  elif url == "http://www.google.com/reader/api/0/subscription/edit?client=mekk.reader_client":
+    status_code = 500
+    result = "Error"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = status_code
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_retry_get(mock):
+  c = gaereader.GoogleReaderClient("login", "password",
+                                   retry_policy=gaereader.RetryPolicy(initial_delay=0))
+  assert c.get_subscription_list().get_result() == {"subscriptions": []}
+  assert calls["http://www.google.com/reader/api/0/subscription/list?output=json"] == 3
+  assert c.get_stats()["retries"] == 2
+
+def test_post_not_retried_and_circuit_opens(mock):
+  edit_url = "http://www.google.com/reader/api/0/subscription/edit?client=mekk.reader_client"
+  c = gaereader.GoogleReaderClient("login", "password",
+                                   retry_policy=gaereader.RetryPolicy(initial_delay=0),
+                                   circuit_breakers=gaereader.CircuitBreakers(failure_threshold=2))
+  for i in range(2):
+    future = c.unsubscribe_feed("feed_url")
+    assert isinstance(future.get_exception(), urllib2.HTTPError)
+  assert calls[edit_url] == 2
+
+  future = c.unsubscribe_feed("feed_url")
+  assert isinstance(future.get_exception(), gaereader.GoogleServiceUnavailable)
+  assert calls[edit_url] == 2
+  assert c.get_stats()["circuits"]["edit"] == "open"
+  # other endpoint families are not affected (and retries of one call,
+  # failing twice before it succeeds, do not open the breaker)
+  assert c.get_subscription_list().get_result() == {"subscriptions": []}
+  assert calls["http://www.google.com/reader/api/0/subscription/list?output=json"] == 3
+  assert c.get_stats()["circuits"]["list"] == "closed"
+
+def test_CircuitBreaker():
+  now = [0.0]
+  breaker = gaereader.CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+  breaker.record_failure()
+  assert breaker.allow()
+  breaker.record_failure()
+  assert breaker.state == "open"
+  assert not breaker.allow()
+  now[0] = 10.0
+  assert breaker.state == "half-open"
+  assert breaker.allow()
+  assert not breaker.allow()
+  breaker.record_success()
+  assert breaker.state == "closed"
+  assert breaker.allow()
+
+def test_RetryPolicy():
+  policy = gaereader.RetryPolicy(max_attempts=3, initial_delay=1, jitter=0, deadline=2.5)
+  assert policy.backoff(1, 0) == 1
+  assert policy.backoff(2, 1) is None
+  assert policy.backoff(2, 0) == 2
+  assert policy.backoff(3, 0) is None
+
+
+deadlines = []
+
+@ndb.tasklet
+def mock_urlfetch_deadline(self, url, deadline=None, **_kwargv):
+  deadlines.append(deadline)
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url == "http://www.google.com/reader/api/0/tag/list?output=json":
+    result = '{"tags": [{"id":"user/0/"}]}'
+  elif url == "http://www.google.com/reader/api/0/token":
+    result = "TOKEN"
+  elif url == "http://www.google.com/reader/api/0/subscription/edit?client=mekk.reader_client":
+    result = "OK"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock_deadline(request):
+
+  def setup():
+    del deadlines[:]
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch_deadline)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_deadline_split(mock_deadline):
+  c = gaereader.GoogleReaderClient("login", "password")
+  del deadlines[:]
+  assert c.add_feed_tag("feed_url", "title", "tag", deadline=20).get_exception() is None
+  token, tag_list, edit = deadlines
+  assert 0 < token <= 10
+  assert 0 < tag_list <= 10
+  assert 10 < edit <= 20
+
+def test_deadline_exceeded(mock_deadline):
+  c = gaereader.GoogleReaderClient("login", "password")
+  future = c.get_tag_list(deadline=gaereader.Deadline(0))
+  assert isinstance(future.get_exception(), gaereader.GoogleDeadlineExceeded)
+  assert c.get_stats()["deadline_exceeded"] == 1
+
+def test_deadline_includes_slot_wait(mock_deadline):
+  limiter = gaereader.AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=1)
+  c = gaereader.GoogleReaderClient("login", "password", concurrency=limiter)
+  del deadlines[:]
+
+  @ndb.tasklet
+  def hold(seconds):
+    started = yield limiter.acquire()
+    yield ndb.sleep(seconds)
+    limiter.release(started)
+
+  @ndb.synctasklet
+  def run(seconds, deadline):
+    holder = hold(seconds)
+    future = c.get_tag_list(deadline=gaereader.Deadline(deadline))
+    yield holder
+    raise ndb.Return(future.get_exception())
+
+  assert run(0.3, 0.5) is None
+  assert deadlines[-1] <= 0.25
+
+  assert isinstance(run(0.3, 0.2), gaereader.GoogleDeadlineExceeded)
+  assert limiter.in_flight == 0
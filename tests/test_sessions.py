@@ -0,0 +1,127 @@
+import collections
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+testbed.init_memcache_stub()
+testbed.init_datastore_v3_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+expired = set()
+
+@ndb.tasklet
+def mock_urlfetch(self, url, payload=None, headers=None, **_kwargv):
+  calls[url] += 1
+  status_code = 200
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=SESSION%d" % calls[url]
+  elif headers["Authorization"] in expired:
+    status_code = 401
+    result = "Unauthorized"
+  elif url == "http://www.google.com/reader/api/0/token":
+    result = "TOKEN%d" % calls[url]
+  elif url == "http://www.google.com/reader/api/0/subscription/edit?client=mekk.reader_client":
+    result = "OK"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = status_code
+  result.headers = {}
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    expired.clear()
+    ndb.get_context().clear_cache()
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+LOGIN_URL = "https://www.google.com/accounts/ClientLogin"
+TOKEN_URL = "http://www.google.com/reader/api/0/token"
+
+@pytest.mark.parametrize("store_class", [
+    gaereader.MemorySessionStore,
+    gaereader.MemcacheSessionStore,
+    gaereader.NdbSessionStore,
+    ])
+def test_session_reused(mock, store_class):
+  store = store_class()
+  store.delete("login").get_result()
+  c1 = gaereader.GoogleReaderClient("login", "password", session_store=store)
+  assert c1._get_token().get_result() == "TOKEN1"
+  c2 = gaereader.GoogleReaderClient("login", "password", session_store=store)
+  assert c2.session_id == "SESSION1"
+  assert c2._get_token().get_result() == "TOKEN1"
+  assert calls[LOGIN_URL] == 1
+  assert calls[TOKEN_URL] == 1
+
+def test_no_store_logs_in(mock):
+  gaereader.GoogleReaderClient("login", "password")
+  gaereader.GoogleReaderClient("login", "password")
+  assert calls[LOGIN_URL] == 2
+
+def test_rejected_session_renewed(mock):
+  store = gaereader.MemorySessionStore()
+  c1 = gaereader.GoogleReaderClient("login", "password", session_store=store)
+  expired.add("GoogleLogin auth=" + c1.session_id)
+
+  c2 = gaereader.GoogleReaderClient("login", "password", session_store=store)
+  assert c2.unsubscribe_feed("feed").get_exception() is None
+  assert c2.session_id == "SESSION2"
+  assert c2.get_stats()["relogins"] == 1
+  assert store.get("login").get_result()["session_id"] == c2.session_id
+  assert calls[LOGIN_URL] == 2
+
+def test_concurrent_rejections_share_login(mock):
+  store = gaereader.MemorySessionStore()
+  c = gaereader.GoogleReaderClient("login", "password", session_store=store)
+  expired.add("GoogleLogin auth=" + c.session_id)
+
+  @ndb.synctasklet
+  def fan_out():
+    yield [c.unsubscribe_feed("feed%d" % i) for i in range(5)]
+
+  fan_out()
+  assert calls[LOGIN_URL] == 2
+
+def test_lazy_login_on_first_call(mock):
+  c = gaereader.GoogleReaderClient("login", "password", lazy=True)
+  assert calls[LOGIN_URL] == 0
+  assert c._get_token().get_result() == "TOKEN1"
+  assert c.session_id == "SESSION1"
+  assert calls[LOGIN_URL] == 1
+
+def test_create_async(mock):
+  store = gaereader.MemorySessionStore()
+
+  @ndb.synctasklet
+  def create():
+    clients = yield [gaereader.GoogleReaderClient.create_async(
+                         "login%d" % i, "password", session_store=store)
+                     for i in range(3)]
+    raise ndb.Return(clients)
+
+  clients = create()
+  assert [c.login for c in clients] == ["login0", "login1", "login2"]
+  assert len(set(c.session_id for c in clients)) == 3
+  assert calls[LOGIN_URL] == 3
@@ -0,0 +1,92 @@
+import collections
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+delay = [0.01]
+
+@ndb.tasklet
+def mock_urlfetch(self, url, **_kwargv):
+  calls[url] += 1
+  yield ndb.sleep(delay[0])
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url == "http://www.google.com/reader/api/0/tag/list?output=json":
+    result = '{"tags": [{"id":"user/0/"}]}'
+  elif url == "http://www.google.com/reader/atom/feed/url":
+    result = '<?xml version="1.0"?><feed><entry><id>id</id></entry></feed>'
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = 200
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    delay[0] = 0.01
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_single_flight(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+
+  @ndb.synctasklet
+  def fan_out():
+    results = yield [c.tag_id("tag%d" % i) for i in range(20)]
+    atoms = yield [c.get_feed_atom("url") for i in range(20)]
+    raise ndb.Return(results, atoms)
+
+  results, atoms = fan_out()
+  assert results == ["user/0/label/tag%d" % i for i in range(20)]
+  assert calls["http://www.google.com/reader/api/0/tag/list?output=json"] == 1
+  assert calls["http://www.google.com/reader/atom/feed/url"] == 1
+  assert all(atom is atoms[0] for atom in atoms)
+
+  # finished calls are not cached
+  c.get_feed_atom("url").get_result()
+  assert calls["http://www.google.com/reader/atom/feed/url"] == 2
+
+def test_single_flight_deadlines(mock):
+  import time
+  c = gaereader.GoogleReaderClient("login", "password")
+  url = "http://www.google.com/reader/api/0/tag/list?output=json"
+  delay[0] = 0.3
+
+  # joiner waits for the shared call only within its own deadline
+  first = c.get_tag_list()
+  second = c.get_tag_list(deadline=0.1)
+  started = time.time()
+  with pytest.raises(gaereader.GoogleDeadlineExceeded):
+    second.get_result()
+  assert time.time() - started < 0.25
+  assert first.get_result()["tags"]
+  assert calls[url] == 1
+
+  # call started under a deadline is not shared with looser callers
+  first = c.get_tag_list(deadline=5)
+  second = c.get_tag_list()
+  third = c.get_tag_list(deadline=1)
+  assert first.get_result() and second.get_result() and third.get_result()
+  assert calls[url] == 3
@@ -0,0 +1,122 @@
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_memcache_stub()
+
+def test_TokenBucket():
+  now = [0.0]
+  bucket = gaereader.TokenBucket(2, 4, clock=lambda: now[0])
+  assert [bucket.reserve() for i in range(4)] == [0, 0, 0, 0]
+  assert bucket.reserve() == 0.5
+  assert bucket.reserve() == 1.0
+  now[0] = 10.0
+  assert bucket.reserve() == 0
+
+def test_RateLimiter_families():
+  limiter = gaereader.RateLimiter(limits={"edit": (1, 1), "default": (100, 100)})
+  assert limiter._bucket("edit").rate == 1
+  assert limiter._bucket("atom").rate == 100
+  assert gaereader.RateLimiter()._bucket("edit") is None
+
+def test_TokenBucket_fair():
+  bucket = gaereader.TokenBucket(100, 1)
+  served = []
+
+  @ndb.tasklet
+  def call(key, n):
+    yield bucket.acquire(key=key)
+    served.append((key, n))
+
+  futures = [call("heavy", n) for n in range(4)] + [call("light", 0)]
+  ndb.Future.wait_all(futures)
+  assert served == [("heavy", 0), ("heavy", 1), ("light", 0), ("heavy", 2), ("heavy", 3)]
+
+def test_MemcacheRateLimit():
+  now = [100.0]
+  limit = gaereader.MemcacheRateLimit(2, clock=lambda: now[0])
+
+  @ndb.synctasklet
+  def acquire_twice():
+    yield limit.acquire("login:edit")
+    yield limit.acquire("login:edit")
+
+  acquire_twice()
+  assert ndb.get_context().memcache_get("gaereader:rate:login:edit:100").get_result() == 2
+
+def test_AdaptiveConcurrencyLimiter():
+  now = [0.0]
+  limiter = gaereader.AdaptiveConcurrencyLimiter(initial=2, minimum=1, maximum=4,
+                                                 latency_target=1, clock=lambda: now[0])
+
+  first = limiter.acquire()
+  second = limiter.acquire()
+  third = limiter.acquire()
+  first.wait()
+  second.wait()
+  while not limiter.snapshot()["waiting"]:
+    ndb.eventloop.run1()
+  assert not third.done()
+  assert limiter.snapshot() == {"limit": 2, "in_flight": 2, "waiting": 1, "decreases": 0}
+
+  # healthy calls raise the cap additively
+  limiter.release(first.get_result())
+  limiter.release(second.get_result())
+  ndb.eventloop.run()
+  assert third.done()
+  assert abs(limiter.limit - 2.9) < 1e-9
+
+  # overload halves it, but only once per round trip
+  started = limiter.acquire().get_result()
+  now[0] = 2.0
+  limiter.release(third.get_result(), overloaded=True)
+  limiter.release(started, overloaded=True)
+  assert abs(limiter.limit - 1.45) < 1e-9
+  assert limiter.snapshot() == {"limit": 1, "in_flight": 0, "waiting": 0, "decreases": 1}
+
+def test_AdaptiveConcurrencyLimiter_fair():
+  limiter = gaereader.AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=1)
+  served = []
+
+  @ndb.tasklet
+  def call(key, n):
+    started = yield limiter.acquire(key)
+    served.append((key, n))
+    yield ndb.sleep(0)
+    limiter.release(started)
+
+  futures = [call("heavy", n) for n in range(4)] + [call("light", 0)]
+  ndb.eventloop.run()
+  assert all(f.done() for f in futures)
+  assert served == [("heavy", 0), ("heavy", 1), ("light", 0), ("heavy", 2), ("heavy", 3)]
+
+def test_AdaptiveConcurrencyLimiter_threads():
+  import threading
+  limiter = gaereader.AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=1,
+                                                 poll_interval=0.01)
+  served = []
+
+  @ndb.tasklet
+  def call(key):
+    started = yield limiter.acquire(key)
+    served.append(key)
+    yield ndb.sleep(0.02)
+    limiter.release(started)
+
+  def run(key):
+    try:
+      ndb.Future.wait_all([call(key) for _ in range(3)])
+    except Exception, e:
+      served.append(e)
+
+  threads = [threading.Thread(target=run, args=(key,)) for key in ("a", "b")]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join(10)
+  assert not any(thread.is_alive() for thread in threads)
+  assert sorted(served) == ["a", "a", "a", "b", "b", "b"]
+  assert limiter.snapshot()["in_flight"] == 0
@@ -0,0 +1,89 @@
+import collections
+import urlparse
+
+import pytest
+
+import gaereader
+from gaereader import reader_client
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+calls = collections.Counter()
+tokens = []
+
+@ndb.tasklet
+def mock_urlfetch(self, url, payload=None, **_kwargv):
+  calls[url] += 1
+  headers = {}
+  status_code = 200
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = "Auth=DUMMY"
+  elif url == "http://www.google.com/reader/api/0/token":
+    yield ndb.sleep(0.01)
+    result = "TOKEN%d" % calls[url]
+  elif url == "http://www.google.com/reader/api/0/subscription/edit?client=mekk.reader_client":
+    token = dict(urlparse.parse_qsl(payload))["T"]
+    tokens.append(token)
+    if token == "TOKEN1":
+      status_code = 401
+      headers["X-Reader-Google-Bad-Token"] = "true"
+      result = "Unauthorized"
+    else:
+      result = "OK"
+  else:
+    raise ValueError(url)
+
+  result = Result(result)
+  result.status_code = status_code
+  result.headers = headers
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock(request):
+
+  def setup():
+    calls.clear()
+    del tokens[:]
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_token_single_flight(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+
+  @ndb.synctasklet
+  def fan_out():
+    result = yield [c._get_token() for i in range(10)]
+    raise ndb.Return(result)
+
+  assert fan_out() == ["TOKEN1"] * 10
+  assert calls["http://www.google.com/reader/api/0/token"] == 1
+
+def test_token_refreshed_before_expiry(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  assert c._get_token().get_result() == "TOKEN1"
+  c.cached_token_time -= reader_client.TOKEN_VALID_TIME - reader_client.TOKEN_REFRESH_MARGIN + 1
+  # still valid token is returned at once, new one is fetched in background
+  assert c._get_token().get_result() == "TOKEN1"
+  ndb.eventloop.run()
+  assert c.cached_token == "TOKEN2"
+  assert c._get_token().get_result() == "TOKEN2"
+
+def test_bad_token_replayed(mock):
+  c = gaereader.GoogleReaderClient("login", "password")
+  assert c.unsubscribe_feed("feed").get_exception() is None
+  assert tokens == ["TOKEN1", "TOKEN2"]
+  assert c.get_stats()["bad_token"] == 1
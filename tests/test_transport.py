@@ -0,0 +1,171 @@
+import BaseHTTPServer
+import socket
+import threading
+import time
+import zlib
+
+import pytest
+
+import gaereader
+
+from google.appengine.ext import ndb, testbed
+testbed = testbed.Testbed()
+testbed.activate()
+testbed.init_urlfetch_stub()
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  connections = set()
+
+  requests = 0
+
+  def do_GET(self):
+    self.connections.add(self.client_address)
+    Handler.requests += 1
+    if self.path == "/slow":
+      time.sleep(0.3)
+    body = "path=%s" % self.path
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+    if self.path == "/close":
+      # drop the connection without telling the client
+      self.close_connection = 1
+
+  def do_POST(self):
+    self.connections.add(self.client_address)
+    Handler.requests += 1
+    body = self.rfile.read(int(self.headers["Content-Length"]))
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+def pytest_funcarg__server(request):
+
+  def setup():
+    Handler.connections = set()
+    Handler.requests = 0
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+  def teardown(server):
+    server.shutdown()
+    server.server_close()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_PooledTransport_keepalive(server):
+  url = "http://127.0.0.1:%d" % server.server_address[1]
+  transport = gaereader.PooledTransport()
+
+  for i in range(3):
+    response = transport.fetch(url + "/get/%d" % i).get_result()
+    assert response.status_code == 200
+    assert response.content == "path=/get/%d" % i
+
+  response = transport.fetch(url + "/post", payload="a=1", method="POST").get_result()
+  assert response.content == "a=1"
+  assert response.header("Content-Length") == "3"
+
+  assert len(Handler.connections) == 1
+  transport.close()
+
+def test_PooledTransport_stale_connection(server):
+  url = "http://127.0.0.1:%d" % server.server_address[1]
+  transport = gaereader.PooledTransport()
+
+  # GET is sent again on a fresh connection
+  transport.fetch(url + "/close").get_result()
+  assert transport.fetch(url + "/again").get_result().content == "path=/again"
+
+  # POST only if the caller says it is safe
+  transport.fetch(url + "/close").get_result()
+  with pytest.raises(Exception):
+    transport.fetch(url + "/post", payload="a=1", method="POST").get_result()
+  transport.fetch(url + "/close").get_result()
+  response = transport.fetch(url + "/post", payload="a=1", method="POST",
+                             retry_safe=True).get_result()
+  assert response.content == "a=1"
+  transport.close()
+
+def test_PooledTransport_timeout_not_retried(server):
+  url = "http://127.0.0.1:%d" % server.server_address[1]
+  transport = gaereader.PooledTransport()
+  transport.fetch(url + "/first").get_result()
+  Handler.requests = 0
+  with pytest.raises(socket.timeout):
+    transport.fetch(url + "/slow", deadline=0.1).get_result()
+  time.sleep(0.4)
+  assert Handler.requests == 1
+  transport.close()
+
+class Result(str):
+  def __init__(self, value):
+    super(Result, self).__init__(value)
+    self.content = value
+
+ATOM = '<?xml version="1.0"?><feed>%s</feed>' % ("<entry><id>id</id></entry>" * 100)
+
+def compress(data, wbits):
+  obj = zlib.compressobj(9, zlib.DEFLATED, wbits)
+  return obj.compress(data) + obj.flush()
+
+@ndb.tasklet
+def mock_urlfetch_gzip(self, url, headers=None, **_kwargv):
+  if url == "https://www.google.com/accounts/ClientLogin":
+    result = Result("Auth=DUMMY")
+    result.headers = {}
+  else:
+    assert headers["Accept-Encoding"] == "gzip, deflate"
+    if url == "http://www.google.com/reader/atom/feed/gzip":
+      result = Result(compress(ATOM, 16 + zlib.MAX_WBITS))
+      result.headers = {"Content-Encoding": "gzip"}
+    elif url == "http://www.google.com/reader/atom/feed/deflate":
+      result = Result(compress(ATOM, -zlib.MAX_WBITS))
+      result.headers = {"Content-Encoding": "deflate"}
+    else:
+      raise ValueError(url)
+  result.status_code = 200
+  result.url = url
+  raise ndb.Return(result)
+
+def pytest_funcarg__mock_gzip(request):
+
+  def setup():
+    mock = request.getfuncargvalue("monkeypatch")
+    mock.setattr(ndb.Context, "urlfetch", mock_urlfetch_gzip)
+    return mock
+
+  def teardown(mock):
+    mock.undo()
+
+  return request.cached_setup(setup=setup, teardown=teardown, scope="function")
+
+def test_compressed_replies(mock_gzip):
+  c = gaereader.GoogleReaderClient("login", "password")
+  c.stats.reset()
+
+  assert c.get_feed_atom("gzip", format="xml").get_result() == ATOM
+  assert c.get_feed_atom("deflate", format="xml").get_result() == ATOM
+
+  stats = c.get_stats()
+  assert stats["calls"] == 2
+  assert stats["bytes_content"] == 2 * len(ATOM)
+  assert stats["bytes_wire"] < len(ATOM)
+
+def test_PooledTransport_deadline_not_kept(server):
+  url = "http://127.0.0.1:%d" % server.server_address[1]
+  transport = gaereader.PooledTransport(timeout=30)
+  transport.fetch(url + "/short", deadline=0.1).get_result()
+  (conn,), = transport._idle.values()
+  assert conn.timeout == 30
+  assert conn.sock.gettimeout() == 30
+  transport.close()